@@ -7,7 +7,11 @@ import screed
 import csv
 import os
 import shutil
-from kiln import InputFile, OutputRecords, check_dna, remove_extension
+from kiln import (InputFile, InputFileStore, OutputRecords, FileInfoCache,
+                  remove_extension, scan_fasta_files, walk_directory,
+                  DEFAULT_SAMPLE_SIZE, DEFAULT_SAMPLE_RECORDS,
+                  ExternalInputFileStore, ShardedOutputRecords,
+                  FromfileDelta)
 
 from sourmash.tax.tax_utils import MultiLineageDB
 from sourmash.logging import notify, error
@@ -17,9 +21,36 @@ def main():
     p.add_argument('filenames', nargs='*', help="names of files to process")
     p.add_argument('-F', '--file-list', action='append',
                    help='text files with filenames to add to command line',)
+    p.add_argument('--from-directory', action='append', default=[],
+                   help='directories to search recursively for files to add to command line')
+    p.add_argument('--include', action='append', default=[],
+                   help="with --from-directory, only add files matching this glob pattern, e.g. '*_genomic.fna.gz'; may be given multiple times")
+    p.add_argument('--exclude', action='append', default=[],
+                   help="with --from-directory, do not add files matching this glob pattern; may be given multiple times")
     p.add_argument('-o', '--output-csv', required=True)
+    p.add_argument('-R', '--report-errors-to',
+                   help='output errors to this file; default <csv>.error-report.txt')
     p.add_argument('--ident-from-filename', action='store_true',
                    help="determine identifer from filename prefixes")
+    p.add_argument('-j', '--jobs', type=int, default=1,
+                   help='number of processes to use for reading files (default 1)')
+    p.add_argument('--sample-size', type=int, default=DEFAULT_SAMPLE_SIZE,
+                   help=f'bytes of sequence to read from each file to determine its moltype (default {DEFAULT_SAMPLE_SIZE})')
+    p.add_argument('--sample-records', type=int,
+                   default=DEFAULT_SAMPLE_RECORDS,
+                   help=f'number of records to read from each file to determine its moltype (default {DEFAULT_SAMPLE_RECORDS})')
+    p.add_argument('--cache',
+                   help='sqlite file used to cache information about input files between runs; unchanged files are not re-read with the same --sample-size and --sample-records')
+    p.add_argument('--external-sort', action='store_true',
+                   help='pair up genome and protein files on disk rather than in memory, for very large inputs; output is sorted by identifier')
+    p.add_argument('--sort-buffer-size', type=int, default=1_000_000,
+                   help='with --external-sort, number of files to sort in memory at a time (default 1,000,000)')
+    p.add_argument('--tmpdir',
+                   help='with --external-sort, put temporary files here')
+    p.add_argument('--shards', type=int, default=0,
+                   help="split output into this many CSV files of similar total file size, '<csv>.0.csv' etc., listed in '<csv>.shards.csv'")
+    p.add_argument('--previous',
+                   help="fromfile CSV (or '.shards.csv' index) from a previous run; also write new, changed, and removed entries to '<csv>.added.csv', '<csv>.changed.csv', and '<csv>.removed.csv'")
     args = p.parse_args()
 
     if not args.filenames:
@@ -33,30 +64,73 @@ def main():
             notify(f"Loaded {len(filelist)} entries from '{ff}'")
         args.filenames.extend(filelist)
 
+    # walk --from-directory; keep the stat results so we need not re-stat.
+    file_stats = [None] * len(args.filenames)
+    for dirname in args.from_directory:
+        n_found = 0
+        for path, st in walk_directory(dirname, include=args.include,
+                                       exclude=args.exclude):
+            args.filenames.append(path)
+            file_stats.append(st)
+            n_found += 1
+        notify(f"Found {n_found} entries under '{dirname}'")
+
     if not args.filenames:
-        error("** ERROR: no input filenames and no --file-list provided.")
+        error("** ERROR: no input filenames, --file-list, or --from-directory provided.")
         sys.exit(-1)
 
-    output = OutputRecords(args.output_csv)
+    # load the previous build before opening output, which may overwrite it.
+    delta = None
+    if args.previous:
+        delta = FromfileDelta(args.previous, args.output_csv)
+        notify(f"Loaded {len(delta.previous)} entries from previous build '{args.previous}'")
+        delta.open()
+
+    if args.shards:
+        output = ShardedOutputRecords(args.output_csv, args.shards)
+    else:
+        output = OutputRecords(args.output_csv)
     output.open()
 
-    fileinfo_d = {}
+    # report file
+    report_filename = args.output_csv + '.error-report.txt'
+    if args.report_errors_to:
+        report_filename = args.report_errors_to
+    notify(f"Any survivable errors will be reported to '{report_filename}'")
+    report_fp = open(report_filename, "wt")
+
+    num_ambiguous = 0
+
+    # track Inputfile objects by name - or, with --external-sort, spill
+    # them to disk and pair them up when writing.
+    fileinfo_d = InputFileStore()
+    if args.external_sort:
+        external_store = ExternalInputFileStore(buffer_size=args.sort_buffer_size,
+                                                tmpdir=args.tmpdir)
+
+    cache = None
+    if args.cache:
+        cache = FileInfoCache(args.cache)
+
+    # read first records in parallel (if requested) but in input order.
+    scans = scan_fasta_files(args.filenames, file_stats, cache=cache,
+                             jobs=args.jobs, sample_size=args.sample_size,
+                             max_records=args.sample_records)
 
     n = 0
-    for filename in args.filenames:
+    for filename, st, record_name, moltype, confidence in scans:
         print(f"processing file '{filename}'")
 
         fileinfo = InputFile()
 
-        record = None
-        for record in screed.open(filename):
-            record_name = record.name
-            break
-
-        if record is None:
+        if record_name is None:
             assert 0, f"no sequences in {filename}"
 
-        is_dna = check_dna(record.sequence)
+        if moltype == "ambiguous":
+            num_ambiguous += 1
+            print(f"ambiguous or mixed moltype: {filename}", file=report_fp)
+            error(f"** SKIPPING: cannot tell if '{filename}' is DNA or protein.")
+            continue
 
         # figure out identifiers from first record
         if not args.ident_from_filename:
@@ -78,30 +152,66 @@ def main():
             fileinfo.full_ident = name
             fileinfo.name = name
 
-        if is_dna:
+        if moltype == "DNA":
             fileinfo.genome_filename = filename
+            fileinfo.genome_size = st.st_size
         else:
             fileinfo.protein_filename = filename
+            fileinfo.protein_size = st.st_size
 
-            
-        moltype = "DNA" if is_dna else "protein"
+        if args.external_sort:
+            print(f"(saving record for identifier '{fileinfo.ident}' moltype={moltype} confidence={confidence:.2f})")
+            assert not fileinfo.is_empty(), fileinfo
+            external_store.add(fileinfo)
+            continue
 
         previous = fileinfo_d.get(fileinfo.ident)
         if previous is not None:
-            print(f"(merging into existing record '{fileinfo.ident}' moltype={moltype})")
+            print(f"(merging into existing record '{fileinfo.ident}' moltype={moltype} confidence={confidence:.2f})")
             fileinfo = previous.merge(fileinfo)
         else:
-            print(f"(new record for identifier '{fileinfo.ident}' moltype={moltype})")
+            print(f"(new record for identifier '{fileinfo.ident}' moltype={moltype} confidence={confidence:.2f})")
 
-        assert not fileinfo.is_empty(), fileinfo.__dict__
+        assert not fileinfo.is_empty(), fileinfo
         fileinfo_d[fileinfo.ident] = fileinfo
 
-    for n, (ident, fileinfo) in enumerate(fileinfo_d.items()):
+    if args.external_sort:
+        records = external_store.merged(lambda previous, fileinfo: previous.merge(fileinfo))
+    else:
+        if args.shards:
+            output.plan( fileinfo for (ident, fileinfo) in fileinfo_d.items() )
+        records = ( fileinfo for (ident, fileinfo) in fileinfo_d.items() )
+
+    num_written = 0
+    for fileinfo in records:
         output.write_record(fileinfo)
+        if delta is not None:
+            delta.write_record(fileinfo)
+        num_written += 1
 
     output.close()
+    if delta is not None:
+        delta.close()
+    report_fp.close()
+
+    if cache is not None:
+        cache.close()
+        notify(f"used cached information for {cache.n_hits} of {cache.n_hits + cache.n_misses} files in '{args.cache}'")
+
     print('---')
-    print(f"wrote {len(fileinfo_d)} entries to '{args.output_csv}'")
+    if args.shards:
+        print(f"wrote {num_written} entries to {args.shards} shards listed in '{output.filename}'")
+    else:
+        print(f"wrote {num_written} entries to '{args.output_csv}'")
+
+    if delta is not None:
+        print(f"compared to '{args.previous}': {delta.num_added} added, {delta.num_changed} changed, {delta.num_removed} removed, {delta.num_unchanged} unchanged")
+        print(f"wrote delta to '{delta.added.filename}', '{delta.changed.filename}', and '{delta.removed.filename}'")
+
+    if num_ambiguous:
+        notify(f"{num_ambiguous} files had ambiguous or mixed moltypes.")
+        error(f"** Errors were encountered ;(. See details in '{report_filename}'.")
+        return -1
 
     return 0
 
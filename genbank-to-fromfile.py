@@ -8,7 +8,10 @@ import screed
 import csv
 import os
 import shutil
-from kiln import InputFile, OutputRecords
+from kiln import (InputFile, InputFileStore, OutputRecords,
+                  AssemblySummaryIndex, load_assembly_summary, ordered_map,
+                  walk_directory, ExternalInputFileStore,
+                  ShardedOutputRecords, FromfileDelta)
 
 from sourmash.logging import error, notify
 from sourmash.cli.utils import add_picklist_args
@@ -17,10 +20,22 @@ from sourmash.picklist import PickStyle
 
 
 usage = """
-   ./genbank-to-fromfile.py filenames -o <out.csv> -S <assembly_summary>
+   ./genbank-to-fromfile.py filenames -o <out.csv> -S <assembly_summary> [-S ...]
 """
 
-assembly_summary_fieldnames = "assembly_accession	bioproject	biosample	wgs_master	refseq_category	taxid	species_taxid	organism_name	infraspecific_name	isolate	version_status	assembly_level	release_type	genome_rep	seq_rel_date	asm_name	submitter	gbrs_paired_asm	paired_asm_comp	ftp_path	excluded_from_refseq	relation_to_type_material	asm_not_live_date".split("\t")
+def get_full_ident(basename):
+    "Get the versioned identifier, e.g. 'GCF_003317655.1', from a filename."
+    # split filenames of the format 'GCF_003317655.1_genomic.fna.gz'
+    # into identifier 'GCF_003317655.1' and discard the rest.
+    idents = basename.split('_')
+    assert len(idents) >= 2
+
+    # 'full_ident' keeps version, 'ident' does not - use latter for
+    # tax lookup.
+    full_ident = "_".join(idents[:2])
+    assert full_ident.startswith('GCA_') or full_ident.startswith('GCF_')
+
+    return full_ident
 
 
 def main():
@@ -28,6 +43,12 @@ def main():
     p.add_argument('filenames', nargs='*', help="names of files to process")
     p.add_argument('-F', '--file-list', action='append',
                    help='text files with filenames to add to command line',)
+    p.add_argument('--from-directory', action='append', default=[],
+                   help='directories to search recursively for files to add to command line')
+    p.add_argument('--include', action='append', default=[],
+                   help="with --from-directory, only add files matching this glob pattern, e.g. '*_genomic.fna.gz'; may be given multiple times")
+    p.add_argument('--exclude', action='append', default=[],
+                   help="with --from-directory, do not add files matching this glob pattern; may be given multiple times")
     p.add_argument('-o', '--output-csv', required=True,
                    help="output CSV file")
     p.add_argument('-v', '--verbose', action='store_true',
@@ -36,8 +57,23 @@ def main():
                    help='turn on strict success mode')
     p.add_argument('-R', '--report-errors-to',
                    help='output errors to this file; default <csv>.report.txt')
-    p.add_argument('-S', '--assembly-summary-file',
-                   help='assembly_summary.txt format file from NCBI')
+    p.add_argument('-S', '--assembly-summary-file', action='append',
+                   default=[],
+                   help='assembly_summary.txt format file from NCBI; can be given multiple times, e.g. for GenBank and RefSeq')
+    p.add_argument('--index-assembly-summary', action='store_true',
+                   help="build (or refresh) on-disk indices of the -S files, '<file>.idx.sqlite'; once built, it is used automatically")
+    p.add_argument('-j', '--jobs', type=int, default=1,
+                   help='number of threads to use for checking files (default 1)')
+    p.add_argument('--external-sort', action='store_true',
+                   help='pair up genome and protein files on disk rather than in memory, for very large inputs; output is sorted by identifier')
+    p.add_argument('--sort-buffer-size', type=int, default=1_000_000,
+                   help='with --external-sort, number of files to sort in memory at a time (default 1,000,000)')
+    p.add_argument('--tmpdir',
+                   help='with --external-sort, put temporary files here')
+    p.add_argument('--shards', type=int, default=0,
+                   help="split output into this many CSV files of similar total file size, '<csv>.0.csv' etc., listed in '<csv>.shards.csv'")
+    p.add_argument('--previous',
+                   help="fromfile CSV (or '.shards.csv' index) from a previous run; also write new, changed, and removed entries to '<csv>.added.csv', '<csv>.changed.csv', and '<csv>.removed.csv'")
     add_picklist_args(p)
     args = p.parse_args()
 
@@ -52,56 +88,109 @@ def main():
             notify(f"Loaded {len(filelist)} entries from '{ff}'")
             args.filenames.extend(filelist)
 
-    if not args.filenames:
-        error("** ERROR: no input filenames and no --file-list provided.")
+    # walk --from-directory; keep the stat results so we need not re-stat.
+    file_stats = [None] * len(args.filenames)
+    for dirname in args.from_directory:
+        n_found = 0
+        for path, st in walk_directory(dirname, include=args.include,
+                                       exclude=args.exclude):
+            args.filenames.append(path)
+            file_stats.append(st)
+            n_found += 1
+        notify(f"Found {n_found} entries under '{dirname}'")
+
+    if not args.filenames and not args.index_assembly_summary:
+        error("** ERROR: no input filenames, --file-list, or --from-directory provided.")
         sys.exit(-1)
 
     # load/process picklists
     picklist = sourmash_args.load_picklist(args)
+    picklist_matches = lambda full_ident: True
     include_ident = lambda full_ident: True
     if picklist and picklist.coltype not in ('ident', 'identprefix'):
         error("** ERROR: picklist can only use 'ident' or 'identprefix' here.")
         sys.exit(-1)
     elif picklist:
         # code taken from sourmash, src/sourmash/picklist.py:
-        def include_ident(full_ident):
+        def picklist_matches(full_ident):
             q = full_ident
             # mangle into the kinds of values we support here
             q = picklist.preprocess_fn(q)
 
-            # add to the number of queries performed,
-            picklist.n_queries += 1
-
             # determine if ok or not.
             if picklist.pickstyle == PickStyle.INCLUDE:
-                if q in picklist.pickset:
-                    picklist.found.add(q)
-                    return True
+                return q in picklist.pickset
             elif picklist.pickstyle == PickStyle.EXCLUDE:
-                if q not in picklist.pickset:
-                    picklist.found.add(q)
-                    return True
+                return q not in picklist.pickset
+            return False
+
+        def include_ident(full_ident):
+            # add to the number of queries performed,
+            picklist.n_queries += 1
+
+            if picklist_matches(full_ident):
+                picklist.found.add(picklist.preprocess_fn(full_ident))
+                return True
             return False
 
-    # load assembly summary
+    # stat files in parallel (if requested) but in input order.
+    total = len(args.filenames)
+
+    def get_size(n):
+        st = file_stats[n]
+        if st is None:
+            return os.path.getsize(args.filenames[n])
+        return st.st_size
+
+    file_sizes = list(ordered_map(get_size, range(total), jobs=args.jobs))
+
+    # figure out the identifiers we need names for, from the filenames;
+    # zero-size files are skipped (and reported) below, whatever their name.
+    full_idents = [ get_full_ident(os.path.basename(filename)) if size else None
+                    for filename, size in zip(args.filenames, file_sizes) ]
+    wanted = set(filter(picklist_matches, filter(None, full_idents)))
+
+    # load assembly summaries, using the on-disk index where there is one,
+    # and otherwise keeping only the rows we need.
     assembly_info = {}
-    with open(args.assembly_summary_file, newline="") as fp:
-        r = csv.DictReader(fp, delimiter='\t',
-                           fieldnames=assembly_summary_fieldnames)
-        for row in r:
-            if row['assembly_accession'].startswith('#'):
-                continue
+    for summary_filename in args.assembly_summary_file:
+        summary_index = AssemblySummaryIndex(summary_filename)
+        if args.index_assembly_summary or summary_index.exists():
+            if not summary_index.is_current():
+                notify(f"building index '{summary_index.filename}' for '{summary_filename}'")
+                n_indexed = summary_index.build()
+                notify(f"indexed {n_indexed} accessions")
+
+        remaining = wanted - assembly_info.keys()
+        if not remaining:
+            continue
 
-            acc = row['assembly_accession']
-            org_name = row['organism_name']
+        if summary_index.exists():
+            found = summary_index.open().get_many(remaining)
+            summary_index.close()
+            notify(f"Found {len(found)} of {len(remaining)} remaining accessions in index '{summary_index.filename}'")
+        else:
+            found = load_assembly_summary(summary_filename, remaining)
+            notify(f"Loaded {len(found)} of {len(remaining)} remaining accessions from '{summary_filename}'")
 
-            full_name = f"{acc} {org_name}"
-            assembly_info[acc] = full_name
+        assembly_info.update(found)
 
-    notify(f"Loaded {len(assembly_info)} rows from '{args.assembly_summary_file}'")
+    if not args.filenames:
+        notify("no input filenames provided; exiting after indexing.")
+        return 0
 
     # all the output.
-    output = OutputRecords(args.output_csv)
+    # load the previous build before opening output, which may overwrite it.
+    delta = None
+    if args.previous:
+        delta = FromfileDelta(args.previous, args.output_csv)
+        notify(f"Loaded {len(delta.previous)} entries from previous build '{args.previous}'")
+        delta.open()
+
+    if args.shards:
+        output = ShardedOutputRecords(args.output_csv, args.shards)
+    else:
+        output = OutputRecords(args.output_csv)
     output.open()
 
     # report file
@@ -116,16 +205,20 @@ def main():
 
     ### begin processing
 
-    # track Inputfile objects by name:
-    fileinfo_d = {}
+    # track Inputfile objects by name - or, with --external-sort, spill
+    # them to disk and pair them up when writing.
+    fileinfo_d = InputFileStore()
+    if args.external_sort:
+        external_store = ExternalInputFileStore(buffer_size=args.sort_buffer_size,
+                                                tmpdir=args.tmpdir)
 
     n = 0
-    total = len(args.filenames)
-    for n, filename in enumerate(args.filenames):
+
+    for n, (filename, size) in enumerate(zip(args.filenames, file_sizes)):
         basename = os.path.basename(filename)
         notify(f"processing file '{basename}' ({n}/{total})", end='\r')
 
-        if os.path.getsize(filename) == 0:
+        if size == 0:
             num_files_zero_size += 1
             print(f"zero size: {filename}", file=report_fp)
             if args.verbose:
@@ -133,16 +226,7 @@ def main():
             continue
 
         fileinfo = InputFile()
-
-        # split filenames of the format 'GCF_003317655.1_genomic.fna.gz'
-        # into identifier 'GCF_003317655.1' and discard the rest.
-        idents = basename.split('_')
-        assert len(idents) >= 2
-
-        # 'full_ident' keeps version, 'ident' does not - use latter for
-        # tax lookup.
-        full_ident = "_".join(idents[:2])
-        assert full_ident.startswith('GCA_') or full_ident.startswith('GCF_')
+        full_ident = full_idents[n]
 
         if not include_ident(full_ident):
             continue
@@ -158,8 +242,15 @@ def main():
         # this may require refinement?
         if filename.endswith('.faa.gz') or filename.endswith('.faa'):
             fileinfo.protein_filename = filename
+            fileinfo.protein_size = size
         elif filename.endswith('.fna.gz') or filename.endswith('.fna'):
             fileinfo.genome_filename = filename
+            fileinfo.genome_size = size
+
+        if args.external_sort:
+            assert not fileinfo.is_empty(), fileinfo
+            external_store.add(fileinfo)
+            continue
 
         # do we already have this identifer? guess that we're getting
         # the other moltype now. ('merge' will check.)
@@ -182,13 +273,35 @@ def main():
                 notify(f"(new record for name '{fileinfo.name}')")
 
         # double check & save
-        assert not fileinfo.is_empty(), fileinfo.__dict__
+        assert not fileinfo.is_empty(), fileinfo
         fileinfo_d[fileinfo.ident] = fileinfo
 
+    # pair up spilled records, if --external-sort.
+    def merge_spilled(previous, fileinfo):
+        nonlocal num_duplicate_inputs
+        try:
+            return fileinfo.merge(previous)
+        except ValueError as exc:
+            num_duplicate_inputs += 1
+            filename = fileinfo.genome_filename or fileinfo.protein_filename
+            print(f"{str(exc)}: {filename}", file=report_fp)
+            if args.verbose:
+                error(f"** SKIPPING: '{os.path.basename(filename)}' is duplicate.")
+            return previous
+
+    if args.external_sort:
+        records = external_store.merged(merge_spilled)
+    else:
+        if args.shards:
+            output.plan( fileinfo for (ident, fileinfo) in fileinfo_d.items() )
+        records = ( fileinfo for (ident, fileinfo) in fileinfo_d.items() )
+
     # write the things!
+    num_written = 0
     num_genome_only = 0
     num_protein_only = 0
-    for n, (ident, fileinfo) in enumerate(fileinfo_d.items()):
+    for fileinfo in records:
+        ident = fileinfo.ident
         if not fileinfo.protein_filename:
             num_protein_only += 1
             print(f"missing protein file: {ident}", file=report_fp)
@@ -196,12 +309,24 @@ def main():
             num_genome_only += 1
             print(f"missing genome file: {ident}", file=report_fp)
         output.write_record(fileinfo)
+        if delta is not None:
+            delta.write_record(fileinfo)
+        num_written += 1
 
     output.close()
+    if delta is not None:
+        delta.close()
 
     notify(f"processed {total} files.")
     notify('---')
-    notify(f"wrote {len(fileinfo_d)} entries to '{args.output_csv}'")
+    if args.shards:
+        notify(f"wrote {num_written} entries to {args.shards} shards listed in '{output.filename}'")
+    else:
+        notify(f"wrote {num_written} entries to '{args.output_csv}'")
+
+    if delta is not None:
+        notify(f"compared to '{args.previous}': {delta.num_added} added, {delta.num_changed} changed, {delta.num_removed} removed, {delta.num_unchanged} unchanged")
+        notify(f"wrote delta to '{delta.added.filename}', '{delta.changed.filename}', and '{delta.removed.filename}'")
 
     if num_protein_only:
         notify(f"{num_protein_only} entries had only protein (and no genome) files.")
@@ -4,15 +4,341 @@ CTB TODO: change ident to identprefix, full_ident to ident.
 
 import csv
 import os
+import sys
+import sqlite3
+import zlib
+import bz2
+import itertools
+import functools
+import heapq
+import tempfile
+import fnmatch
+import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import screed
+
+# how much sequence, from how many records, to sample from FASTA files
+# to guess the moltype.
+DEFAULT_SAMPLE_SIZE = 64 * 1024
+DEFAULT_SAMPLE_RECORDS = 10
+# records with less sequence than this are not classified on their own.
+DEFAULT_MIN_SAMPLE_LENGTH = 50
+
+# byte tables for classify_moltype.
+_UPPERCASE = bytes.maketrans(b'abcdefghijklmnopqrstuvwxyz',
+                             b'ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+_IGNORED = b' \t\r\n\v\f-'
+_NUCLEOTIDES = b'ACGTUN'
+_IUPAC_AMBIGUITY_CODES = b'RYKMSWBDHV'
+# amino acids that are neither nucleotides nor IUPAC ambiguity codes.
+_PROTEIN_ONLY = b'EFILPQ'
+_AMINO_ACIDS = b'ACDEFGHIKLMNPQRSTVWYX*'
+
+assembly_summary_fieldnames = "assembly_accession	bioproject	biosample	wgs_master	refseq_category	taxid	species_taxid	organism_name	infraspecific_name	isolate	version_status	assembly_level	release_type	genome_rep	seq_rel_date	asm_name	submitter	gbrs_paired_asm	paired_asm_comp	ftp_path	excluded_from_refseq	relation_to_type_material	asm_not_live_date".split("\t")
+
+
+def classify_moltype(seq, *, min_fraction=0.9, min_protein_fraction=0.01):
+    """
+    Classify a sequence (str or bytes) as "DNA", "protein", or "ambiguous".
+
+    Returns (moltype, confidence), where confidence is the fraction of
+    residues consistent with the call (nucleotides for DNA, amino acids for
+    protein, and 0 for "ambiguous"). Case is ignored, so soft-masked
+    sequence is fine, and a sequence of mostly IUPAC nucleotide ambiguity
+    codes is still DNA if at least half of it is ACGT/U/N.
+
+    Sequence with at least 'min_protein_fraction' of amino acids that
+    cannot be nucleotides (E, F, I, L, P, Q) is protein, however much
+    A/C/G/T it contains - e.g. Ala/Gly-rich proteins.
+    """
+    if isinstance(seq, str):
+        seq = seq.encode('latin-1')
+
+    seq = seq.translate(_UPPERCASE, _IGNORED)
+    total = len(seq)
+    if not total:
+        return "ambiguous", 0.0
+
+    # count with deletions rather than loops over characters.
+    non_nucl = seq.translate(None, _NUCLEOTIDES)
+    n_nucl = total - len(non_nucl)
+    n_iupac = len(non_nucl) - len(non_nucl.translate(None,
+                                                     _IUPAC_AMBIGUITY_CODES))
+    n_protein_only = len(non_nucl) - len(non_nucl.translate(None,
+                                                            _PROTEIN_ONLY))
+
+    nucl_frac = n_nucl / total
+    iupac_frac = (n_nucl + n_iupac) / total
+    protein_frac = 1 - len(seq.translate(None, _AMINO_ACIDS)) / total
+    if n_protein_only / total >= min_protein_fraction:
+        return "protein", protein_frac
+    if nucl_frac >= min_fraction:
+        return "DNA", nucl_frac
+    if iupac_frac >= min_fraction and nucl_frac >= 0.5:
+        # mostly ACGT, with ambiguity codes making up the rest.
+        return "DNA", nucl_frac
+    if iupac_frac >= min_fraction:
+        return "ambiguous", 0.0
+    return "protein", protein_frac
 
 
 def check_dna(seq):
-    orig_seq = seq
-    for ch in 'ACGTN':
-        seq = seq.replace(ch, '')
-    if len(seq) > 0.1 * len(orig_seq):
-        return False
-    return True
+    return classify_moltype(seq)[0] == "DNA"
+
+
+def iter_decompressed(filename, *, chunk_size=4096):
+    """
+    Yield decompressed chunks of a plain, gzip (including bgzf and other
+    multi-member gzip), or bzip2 file, reading 'chunk_size' bytes at a time.
+
+    Nothing is read beyond what the consumer asks for.
+    """
+    with open(filename, 'rb') as fp:
+        magic = fp.read(3)
+        fp.seek(0)
+
+        if magic[:2] == b'\x1f\x8b':
+            make_decompressor = lambda: zlib.decompressobj(zlib.MAX_WBITS | 16)
+        elif magic == b'BZh':
+            make_decompressor = bz2.BZ2Decompressor
+        else:
+            while True:
+                data = fp.read(chunk_size)
+                if not data:
+                    break
+                yield data
+            return
+
+        d = make_decompressor()
+        while True:
+            data = fp.read(chunk_size)
+            if not data:
+                break
+
+            while data:
+                out = d.decompress(data)
+                if out:
+                    yield out
+
+                if d.eof:
+                    # start of the next member, for multi-member files.
+                    data = d.unused_data
+                    d = make_decompressor()
+                else:
+                    data = b''
+
+
+def peek_fasta(filename, *, sample_size=DEFAULT_SAMPLE_SIZE, max_records=1):
+    """
+    Return a list of (name, sample) for up to 'max_records' records at the
+    start of a FASTA file, where 'sample' is sequence with whitespace
+    removed. At most 'sample_size' bytes of sequence are sampled in total,
+    and only as much of the file is decompressed as is needed for that.
+
+    Returns an empty list if the file is empty; raises ValueError if it
+    does not look like FASTA.
+    """
+    chunks = iter_decompressed(filename)
+    data = next(chunks, b'')
+
+    records = []
+    n_sampled = 0
+    while data and len(records) < max_records and n_sampled < sample_size:
+        # get the header line.
+        while b'\n' not in data:
+            chunk = next(chunks, None)
+            if chunk is None:
+                break
+            data += chunk
+
+        header, _, data = data.partition(b'\n')
+        header = header.strip()
+        if not header.startswith(b'>'):
+            raise ValueError(f"'{filename}' does not look like FASTA")
+        name = header[1:].strip().decode('utf-8')
+
+        # now collect sequence up to the sample size, or the next record.
+        sample = b''
+        while True:
+            end = data.find(b'>')
+            seq = data if end < 0 else data[:end]
+            sample += seq.translate(None, b' \t\r\n\v\f')
+            if end >= 0:
+                data = data[end:]
+                break
+            if n_sampled + len(sample) >= sample_size:
+                data = b''
+                break
+            data = next(chunks, b'')
+            if not data:
+                break
+
+        sample = sample[:sample_size - n_sampled]
+        n_sampled += len(sample)
+        records.append((name, sample))
+
+    return records
+
+
+def scan_fasta(filename, *, sample_size=DEFAULT_SAMPLE_SIZE,
+               max_records=DEFAULT_SAMPLE_RECORDS,
+               min_length=DEFAULT_MIN_SAMPLE_LENGTH):
+    """
+    Return (name, moltype, confidence) for a sequence file, where 'name'
+    is the name of the first record, and moltype and confidence come
+    from 'classify_moltype' on up to 'max_records' records (and at most
+    'sample_size' bytes of sequence). Files with records of differing
+    moltypes are "ambiguous".
+
+    Records with less than 'min_length' residues sampled - e.g. the
+    last one, cut short by 'sample_size' - are too short to classify on
+    their own, and are only used if all records are that short, pooled.
+
+    Returns (None, None, None) if there are no records.
+    """
+    try:
+        records = peek_fasta(filename, sample_size=sample_size,
+                             max_records=max_records)
+    except ValueError:
+        # not FASTA - hand it to screed, which knows about e.g. FASTQ.
+        records = []
+        for record in screed.open(filename):
+            sample = record.sequence[:sample_size].encode('latin-1')
+            records.append((record.name, sample))
+            if len(records) >= max_records:
+                break
+
+    if not records:
+        return None, None, None
+
+    samples = [ sample for (_, sample) in records
+                if len(sample) >= min_length ]
+    if not samples:
+        samples = [ b''.join( sample for (_, sample) in records ) ]
+
+    calls = [ classify_moltype(sample) for sample in samples ]
+    moltypes = set( moltype for (moltype, _) in calls )
+    if len(moltypes) > 1:
+        moltype, confidence = "ambiguous", 0.0
+    else:
+        moltype = moltypes.pop()
+        confidence = min( confidence for (_, confidence) in calls )
+
+    name = records[0][0]
+    return name, moltype, confidence
+
+
+def scan_fasta_files(filenames, file_stats=None, *, cache=None, jobs=1,
+                     sample_size=DEFAULT_SAMPLE_SIZE,
+                     max_records=DEFAULT_SAMPLE_RECORDS):
+    """
+    Yield (filename, stat_result, name, moltype, confidence) for each
+    FASTA file in 'filenames', in order, using 'scan_fasta' on 'jobs'
+    processes.
+
+    'file_stats' may supply already-known stat results (or None) for
+    each filename. If a FileInfoCache is given as 'cache', files that
+    have not changed since they were cached are not re-read.
+    """
+    if file_stats is None:
+        file_stats = [None] * len(filenames)
+
+    def get_stat(n):
+        st = file_stats[n]
+        if st is None:
+            st = os.stat(filenames[n])
+        return st
+
+    stats = list(ordered_map(get_stat, range(len(filenames)), jobs=jobs))
+
+    cached = [None] * len(filenames)
+    if cache is not None:
+        cached = [ cache.get(filename, st, sample_size=sample_size,
+                             max_records=max_records)
+                   for filename, st in zip(filenames, stats) ]
+
+    to_scan = ( filename for filename, hit in zip(filenames, cached)
+                if hit is None )
+    scan_fn = functools.partial(scan_fasta, sample_size=sample_size,
+                                max_records=max_records)
+    scans = ordered_map(scan_fn, to_scan, jobs=jobs, processes=True,
+                        chunksize=16)
+
+    for filename, st, hit in zip(filenames, stats, cached):
+        if hit is None:
+            name, moltype, confidence = next(scans)
+            if cache is not None:
+                cache.put(filename, st, name, moltype, confidence,
+                          sample_size=sample_size, max_records=max_records)
+        else:
+            name, moltype, confidence = hit
+
+        yield filename, st, name, moltype, confidence
+
+
+def _map_chunk(fn, chunk):
+    return [ fn(x) for x in chunk ]
+
+
+def ordered_map(fn, iterable, *, jobs=1, processes=False, chunksize=1):
+    """
+    Like 'map(fn, iterable)', but run across 'jobs' worker threads (or
+    processes, if 'processes' is True), yielding results in input order.
+
+    Work is submitted in chunks of 'chunksize' items, and only a bounded
+    number of chunks are in flight at any one time.
+    """
+    if jobs <= 1:
+        yield from map(fn, iterable)
+        return
+
+    executor_cls = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    max_pending = jobs * 4
+
+    it = iter(iterable)
+    with executor_cls(max_workers=jobs) as executor:
+        pending = deque()
+        while True:
+            chunk = list(itertools.islice(it, chunksize))
+            if not chunk:
+                break
+
+            pending.append(executor.submit(_map_chunk, fn, chunk))
+            if len(pending) >= max_pending:
+                yield from pending.popleft().result()
+
+        while pending:
+            yield from pending.popleft().result()
+
+
+def walk_directory(dirname, *, include=None, exclude=None):
+    """
+    Recursively walk 'dirname', yielding (path, stat_result) for each file
+    whose name matches any of the 'include' glob patterns (default: all
+    files) and none of the 'exclude' patterns.
+
+    Uses os.scandir, so each file is only stat-ed once; entries are
+    yielded in sorted order so that the output is deterministic.
+    """
+    with os.scandir(dirname) as it:
+        entries = sorted(it, key=lambda entry: entry.name)
+
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from walk_directory(entry.path, include=include,
+                                      exclude=exclude)
+        elif entry.is_file():
+            name = entry.name
+            if include and not any(fnmatch.fnmatch(name, pattern)
+                                   for pattern in include):
+                continue
+            if exclude and any(fnmatch.fnmatch(name, pattern)
+                               for pattern in exclude):
+                continue
+
+            yield entry.path, entry.stat()
 
 
 def remove_extension(basepath, extra=[]):
@@ -27,6 +353,213 @@ def remove_extension(basepath, extra=[]):
     return basepath
 
 
+def iter_assembly_summary(filename, accessions=None):
+    """
+    Yield (accession, full name) tuples from an NCBI assembly_summary.txt.
+
+    If 'accessions' is given, only rows for those accessions are parsed.
+    """
+    with open(filename, newline="") as fp:
+        if accessions is not None:
+            # cheap pre-filter on the first column before parsing w/csv.
+            fp = ( line for line in fp
+                   if line.split('\t', 1)[0] in accessions )
+
+        r = csv.DictReader(fp, delimiter='\t',
+                           fieldnames=assembly_summary_fieldnames)
+        for row in r:
+            if row['assembly_accession'].startswith('#'):
+                continue
+
+            acc = row['assembly_accession']
+            org_name = row['organism_name']
+
+            yield acc, f"{acc} {org_name}"
+
+
+def load_assembly_summary(filename, accessions):
+    """
+    Load names for the given accessions from an assembly_summary.txt,
+    stopping as soon as all of them have been found.
+    """
+    remaining = set(accessions)
+    found = {}
+    if not remaining:
+        return found
+
+    for acc, full_name in iter_assembly_summary(filename, remaining):
+        found[acc] = full_name
+        remaining.discard(acc)
+        if not remaining:
+            break
+
+    return found
+
+
+class AssemblySummaryIndex:
+    """
+    An on-disk sqlite index of an NCBI assembly_summary.txt file, mapping
+    accessions to names. Lives next to the summary file as
+    '<assembly_summary>.idx.sqlite', and records the size and mtime of the
+    summary file so that stale indices can be detected and rebuilt.
+    """
+    def __init__(self, summary_filename):
+        self.summary_filename = summary_filename
+        self.filename = summary_filename + '.idx.sqlite'
+        self.conn = None
+
+    def _source_stat(self):
+        st = os.stat(self.summary_filename)
+        return st.st_size, st.st_mtime_ns
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def is_current(self):
+        "Does the index exist and match the current summary file?"
+        if not self.exists():
+            return False
+
+        conn = sqlite3.connect(self.filename)
+        try:
+            c = conn.cursor()
+            c.execute('SELECT size, mtime_ns FROM source')
+            stored = c.fetchone()
+        except sqlite3.DatabaseError:
+            return False
+        finally:
+            conn.close()
+
+        return stored == self._source_stat()
+
+    def build(self):
+        "(Re)build the index from the summary file; return # of accessions."
+        self.close()
+        size, mtime_ns = self._source_stat()
+
+        # build into a temp file and then move it into place, so that an
+        # interrupted build never leaves a partial index behind.
+        tmp_filename = self.filename + '.tmp'
+        if os.path.exists(tmp_filename):
+            os.unlink(tmp_filename)
+
+        conn = sqlite3.connect(tmp_filename)
+        c = conn.cursor()
+        c.execute('PRAGMA journal_mode = OFF')
+        c.execute('PRAGMA synchronous = OFF')
+        c.execute('CREATE TABLE source (size INTEGER, mtime_ns INTEGER)')
+        c.execute("""CREATE TABLE assembly_info
+                     (accession TEXT PRIMARY KEY, name TEXT NOT NULL)
+                     WITHOUT ROWID""")
+        # keep the first row for each accession, as load_assembly_summary does.
+        c.executemany('INSERT OR IGNORE INTO assembly_info VALUES (?, ?)',
+                      iter_assembly_summary(self.summary_filename))
+        c.execute('INSERT INTO source VALUES (?, ?)', (size, mtime_ns))
+        conn.commit()
+        conn.close()
+
+        os.replace(tmp_filename, self.filename)
+        return len(self.open())
+
+    def open(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.filename)
+        return self
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def __len__(self):
+        c = self.conn.cursor()
+        c.execute('SELECT COUNT(*) FROM assembly_info')
+        return c.fetchone()[0]
+
+    def get_many(self, accessions, *, batch_size=500):
+        "Return a dict of accession => name for all accessions in the index."
+        found = {}
+        accessions = list(accessions)
+        c = self.conn.cursor()
+        for start in range(0, len(accessions), batch_size):
+            batch = accessions[start:start + batch_size]
+            placeholders = ",".join("?" * len(batch))
+            c.execute(f"""SELECT accession, name FROM assembly_info
+                          WHERE accession IN ({placeholders})""", batch)
+            found.update(c)
+        return found
+
+
+class FileInfoCache:
+    """
+    A persistent sqlite cache of per-file metadata - size, first record
+    name, moltype and its confidence - keyed on absolute path and the
+    sampling parameters used to guess the moltype. Entries are only used
+    if the file's size and mtime are unchanged.
+    """
+    def __init__(self, filename, *, commit_every=1000):
+        self.filename = filename
+        self.commit_every = commit_every
+        self.n_hits = 0
+        self.n_misses = 0
+        self._n_uncommitted = 0
+
+        self.conn = sqlite3.connect(filename)
+
+        # caches from before sampling parameters were recorded can't be used.
+        columns = [ row[1] for row in
+                    self.conn.execute("PRAGMA table_info(file_info)") ]
+        if columns and 'sample_size' not in columns:
+            self.conn.execute("DROP TABLE file_info")
+
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS file_info
+                             (path TEXT NOT NULL,
+                              sample_size INTEGER NOT NULL,
+                              max_records INTEGER NOT NULL,
+                              size INTEGER NOT NULL,
+                              mtime_ns INTEGER NOT NULL,
+                              name TEXT,
+                              moltype TEXT,
+                              confidence REAL,
+                              PRIMARY KEY (path, sample_size, max_records))""")
+
+    def get(self, filename, st, *, sample_size, max_records):
+        """
+        Return (name, moltype, confidence) if cached with these sampling
+        parameters & unchanged, else None.
+        """
+        c = self.conn.cursor()
+        c.execute("""SELECT name, moltype, confidence FROM file_info
+                     WHERE path=? AND sample_size=? AND max_records=?
+                     AND size=? AND mtime_ns=?""",
+                  (os.path.abspath(filename), sample_size, max_records,
+                   st.st_size, st.st_mtime_ns))
+        row = c.fetchone()
+        if row is None:
+            self.n_misses += 1
+        else:
+            self.n_hits += 1
+        return row
+
+    def put(self, filename, st, name, moltype, confidence, *,
+            sample_size, max_records):
+        self.conn.execute("""INSERT OR REPLACE INTO file_info
+                             VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                          (os.path.abspath(filename), sample_size,
+                           max_records, st.st_size, st.st_mtime_ns,
+                           name, moltype, confidence))
+
+        # commit regularly, so that an interrupted run still saves work.
+        self._n_uncommitted += 1
+        if self._n_uncommitted >= self.commit_every:
+            self.conn.commit()
+            self._n_uncommitted = 0
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
 class OutputRecords:
     def __init__(self, filename):
         self.filename = filename
@@ -53,12 +586,181 @@ class OutputRecords:
         self.writer = None
 
 
+class ShardedOutputRecords:
+    """
+    Split output records across 'num_shards' CSV files of roughly equal
+    total genome+protein file size, e.g. for sketching in parallel.
+
+    For output 'out.csv', shards are written to 'out.0.csv', 'out.1.csv',
+    ..., and listed along with their record counts and sizes in the index
+    file 'out.shards.csv', relative to the index file's directory.
+
+    Each record goes to whichever shard is lightest at the time, unless
+    'plan()' has been given all of the records in advance, in which case
+    they are bin packed largest first.
+    """
+    def __init__(self, filename, num_shards):
+        assert num_shards >= 1
+        prefix = filename
+        if prefix.endswith('.csv'):
+            prefix = prefix[:-4]
+
+        self.filename = prefix + '.shards.csv'
+        self.shards = [ OutputRecords(f"{prefix}.{i}.csv")
+                        for i in range(num_shards) ]
+        self.num_records = [0] * num_shards
+        self.total_size = [0] * num_shards
+        self._plan = None
+
+    def open(self):
+        for shard in self.shards:
+            shard.open()
+
+    def plan(self, fileinfos):
+        "Assign records to shards ahead of time, largest first."
+        sizes = [ (-fileinfo.total_size, fileinfo.ident)
+                  for fileinfo in fileinfos ]
+        sizes.sort()
+
+        heap = [ (0, i) for i in range(len(self.shards)) ]
+        self._plan = {}
+        for neg_size, ident in sizes:
+            total, i = heap[0]
+            self._plan[ident] = i
+            heapq.heapreplace(heap, (total - neg_size, i))
+
+    def write_record(self, input_file_obj):
+        if self._plan is not None:
+            i = self._plan[input_file_obj.ident]
+        else:
+            i = min(range(len(self.shards)), key=self.total_size.__getitem__)
+
+        self.shards[i].write_record(input_file_obj)
+        self.num_records[i] += 1
+        self.total_size[i] += input_file_obj.total_size
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+        index_dir = os.path.dirname(self.filename) or '.'
+        with open(self.filename, 'w', newline='') as fp:
+            w = csv.writer(fp)
+            w.writerow(['filename', 'num_records', 'total_size'])
+            for shard, num_records, total_size in zip(self.shards,
+                                                      self.num_records,
+                                                      self.total_size):
+                w.writerow([os.path.relpath(shard.filename, index_dir),
+                            num_records, total_size])
+
+
+def load_fromfile_csv(filename):
+    """
+    Yield InputFile records from a fromfile CSV, as written by
+    OutputRecords - or, given a '.shards.csv' index written by
+    ShardedOutputRecords, from each of the shards it lists.
+    """
+    with open(filename, newline='') as fp:
+        r = csv.DictReader(fp)
+        if 'num_records' in r.fieldnames:
+            # shards are listed relative to the index file.
+            index_dir = os.path.dirname(filename)
+            shard_filenames = [ os.path.join(index_dir, row['filename'])
+                                for row in r ]
+        else:
+            shard_filenames = None
+            for row in r:
+                yield InputFile(row['identprefix'], row['ident'],
+                                row['name'],
+                                row['genome_filename'] or None,
+                                row['protein_filename'] or None)
+
+    if shard_filenames is not None:
+        for shard_filename in shard_filenames:
+            yield from load_fromfile_csv(shard_filename)
+
+
+class FromfileDelta:
+    """
+    Compare records against those in a previous fromfile CSV, and write
+    the differences to three fromfile CSVs: for output 'out.csv',
+    'out.added.csv' and 'out.changed.csv' with the new records, and
+    'out.removed.csv' with the previous records that are no longer present.
+
+    A record has changed if its versioned identifier or either of its
+    filenames differ from the previous record with the same identprefix.
+    """
+    def __init__(self, previous_filename, filename):
+        self.previous = InputFileStore()
+        for fileinfo in load_fromfile_csv(previous_filename):
+            self.previous[fileinfo.ident] = fileinfo
+        self._seen = set()
+
+        prefix = filename
+        if prefix.endswith('.csv'):
+            prefix = prefix[:-4]
+
+        self.added = OutputRecords(prefix + '.added.csv')
+        self.changed = OutputRecords(prefix + '.changed.csv')
+        self.removed = OutputRecords(prefix + '.removed.csv')
+        self.num_added = 0
+        self.num_changed = 0
+        self.num_removed = 0
+        self.num_unchanged = 0
+
+    def open(self):
+        self.added.open()
+        self.changed.open()
+        self.removed.open()
+
+    def write_record(self, input_file_obj):
+        ident = input_file_obj.ident
+        previous = self.previous.get(ident)
+        if previous is None:
+            self.added.write_record(input_file_obj)
+            self.num_added += 1
+            return
+
+        self._seen.add(ident)
+        if (previous.full_ident != input_file_obj.full_ident or
+            previous.genome_filename != input_file_obj.genome_filename or
+            previous.protein_filename != input_file_obj.protein_filename):
+            self.changed.write_record(input_file_obj)
+            self.num_changed += 1
+        else:
+            self.num_unchanged += 1
+
+    def close(self):
+        for ident, previous in self.previous.items():
+            if ident not in self._seen:
+                self.removed.write_record(previous)
+                self.num_removed += 1
+
+        self.added.close()
+        self.changed.close()
+        self.removed.close()
+
+
 class InputFile(object):
-    ident = None
-    full_ident = None
-    genome_filename = None
-    protein_filename = None
-    name = None
+    __slots__ = ('ident', 'full_ident', 'name',
+                 'genome_filename', 'protein_filename',
+                 'genome_size', 'protein_size')
+
+    def __init__(self, ident=None, full_ident=None, name=None,
+                 genome_filename=None, protein_filename=None,
+                 genome_size=0, protein_size=0):
+        self.ident = ident
+        self.full_ident = full_ident
+        self.name = name
+        self.genome_filename = genome_filename
+        self.protein_filename = protein_filename
+        self.genome_size = genome_size
+        self.protein_size = protein_size
+
+    def __repr__(self):
+        return (f"InputFile(ident={self.ident!r}, full_ident={self.full_ident!r}, "
+                f"name={self.name!r}, genome_filename={self.genome_filename!r}, "
+                f"protein_filename={self.protein_filename!r})")
 
     def merge(self, other):
         assert self.ident == other.ident
@@ -73,12 +775,19 @@ class InputFile(object):
         if self.genome_filename:
             assert other.protein_filename
             self.protein_filename = other.protein_filename
+            self.protein_size = other.protein_size
         else:
             assert self.protein_filename
             self.genome_filename = other.genome_filename
+            self.genome_size = other.genome_size
 
         return self
 
+    @property
+    def total_size(self):
+        "combined size of the genome and protein files, in bytes."
+        return self.genome_size + self.protein_size
+
     def is_empty(self):
         if self.name is None:
             return True
@@ -96,3 +805,170 @@ class InputFile(object):
                         name=self.name,
                         genome_filename=self.genome_filename or "",
                         protein_filename=self.protein_filename or ""))
+
+
+class InputFileStore:
+    """
+    A compact store of InputFile records keyed by 'ident', usable in place
+    of a dict of InputFile objects.
+
+    Records are kept in parallel lists rather than as objects, and
+    'full_ident' is stored as its (interned, hence shared) suffix after
+    'ident' - e.g. '.1' - where possible. InputFile objects are only
+    created on access, so modifying a returned InputFile does not change
+    the store; assign it back instead.
+    """
+    def __init__(self):
+        self._index = {}
+        self._full_ident_suffix = []
+        self._name = []
+        self._genome_filename = []
+        self._protein_filename = []
+        self._genome_size = array.array('Q')
+        self._protein_size = array.array('Q')
+
+        # full_idents that do not start with their ident.
+        self._full_ident_other = {}
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, ident):
+        return ident in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def _make(self, ident, i):
+        suffix = self._full_ident_suffix[i]
+        if suffix is None:
+            full_ident = self._full_ident_other.get(ident)
+        else:
+            full_ident = ident + suffix
+
+        return InputFile(ident, full_ident, self._name[i],
+                         self._genome_filename[i], self._protein_filename[i],
+                         self._genome_size[i], self._protein_size[i])
+
+    def get(self, ident, default=None):
+        i = self._index.get(ident)
+        if i is None:
+            return default
+        return self._make(ident, i)
+
+    def __getitem__(self, ident):
+        return self._make(ident, self._index[ident])
+
+    def __setitem__(self, ident, fileinfo):
+        assert ident == fileinfo.ident
+        full_ident = fileinfo.full_ident
+
+        self._full_ident_other.pop(ident, None)
+        if full_ident is not None and full_ident.startswith(ident):
+            suffix = sys.intern(full_ident[len(ident):])
+        else:
+            suffix = None
+            if full_ident is not None:
+                self._full_ident_other[ident] = full_ident
+
+        i = self._index.get(ident)
+        if i is None:
+            self._index[ident] = len(self._full_ident_suffix)
+            self._full_ident_suffix.append(suffix)
+            self._name.append(fileinfo.name)
+            self._genome_filename.append(fileinfo.genome_filename)
+            self._protein_filename.append(fileinfo.protein_filename)
+            self._genome_size.append(fileinfo.genome_size)
+            self._protein_size.append(fileinfo.protein_size)
+        else:
+            self._full_ident_suffix[i] = suffix
+            self._name[i] = fileinfo.name
+            self._genome_filename[i] = fileinfo.genome_filename
+            self._protein_filename[i] = fileinfo.protein_filename
+            self._genome_size[i] = fileinfo.genome_size
+            self._protein_size[i] = fileinfo.protein_size
+
+    def items(self):
+        for ident, i in self._index.items():
+            yield ident, self._make(ident, i)
+
+
+class ExternalInputFileStore:
+    """
+    Pair up InputFile records by 'ident' out-of-core, for inputs too big
+    to track in memory.
+
+    Records are buffered, then sorted by ident and spilled to temporary
+    CSV files every 'buffer_size' records; 'merged()' k-way merges the
+    spill files and yields one combined record per ident, in ident order.
+    """
+    def __init__(self, *, buffer_size=1_000_000, tmpdir=None):
+        self.buffer_size = buffer_size
+        self._tmpdir = tempfile.TemporaryDirectory(prefix='kiln-',
+                                                   dir=tmpdir)
+        self._buffer = []
+        self._spill_files = []
+        self._n_added = 0
+
+    def add(self, fileinfo):
+        # include the input position, so that records for the same ident
+        # come back out in the order they were added.
+        self._buffer.append((fileinfo.ident, self._n_added,
+                             fileinfo.full_ident or "",
+                             fileinfo.name or "",
+                             fileinfo.genome_filename or "",
+                             fileinfo.protein_filename or "",
+                             fileinfo.genome_size,
+                             fileinfo.protein_size))
+        self._n_added += 1
+
+        if len(self._buffer) >= self.buffer_size:
+            self._spill()
+
+    def _spill(self):
+        if not self._buffer:
+            return
+
+        self._buffer.sort()
+        filename = os.path.join(self._tmpdir.name,
+                                f"spill.{len(self._spill_files)}.csv")
+        with open(filename, 'w', newline='') as fp:
+            csv.writer(fp).writerows(self._buffer)
+
+        self._spill_files.append(filename)
+        self._buffer = []
+
+    def _iter_spill_file(self, filename):
+        with open(filename, newline='') as fp:
+            for ident, n, *values, genome_size, protein_size in csv.reader(fp):
+                yield (ident, int(n), *values,
+                       int(genome_size), int(protein_size))
+
+    def merged(self, merge_fn):
+        """
+        Yield one InputFile per ident, in sorted order. Records for the
+        same ident are combined in the order they were added, with
+        'merge_fn(previous, fileinfo)', which returns the combined record.
+        """
+        self._spill()
+        runs = [ self._iter_spill_file(filename)
+                 for filename in self._spill_files ]
+
+        try:
+            rows = heapq.merge(*runs)
+            for ident, group in itertools.groupby(rows, key=lambda r: r[0]):
+                previous = None
+                for (_, _, full_ident, name, genome, protein,
+                     genome_size, protein_size) in group:
+                    fileinfo = InputFile(ident, full_ident or None,
+                                         name or None, genome or None,
+                                         protein or None,
+                                         genome_size, protein_size)
+                    if previous is None:
+                        previous = fileinfo
+                    else:
+                        previous = merge_fn(previous, fileinfo)
+
+                yield previous
+        finally:
+            self._tmpdir.cleanup()
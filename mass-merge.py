@@ -8,23 +8,552 @@ and merges signatures by values in the specified `merge-col`.
 The spreadsheet must contain two columns, 'ident' and the value of `--merge-col`;
 signatures are selected based on 'ident' and renamed to the value found in the merge column.
 Singletons (no additional signatures to merge) will be renamed for consistency.
+
+`--merge-col` can be given several times, from lowest to highest rank (e.g.
+species, then genus); each rank is then merged from the merged signatures
+of the rank below, and saved to the output filename with '{merge_col}'
+replaced by the column name.
+
+`--select` (e.g. `--select DNA:31 --select protein:10`) merges several
+ksize/moltype combinations separately, reading each database only once;
+'{ksize}' and '{moltype}' in the output filename are replaced, or else all
+selections are saved to the same file.
 """
 import sys
+import os
 import argparse
 import csv
-from collections import defaultdict
+import tempfile
+import copy
+import contextlib
+from collections import defaultdict, deque, Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 
 import sourmash
 
 from sourmash.picklist import SignaturePicklist
 from sourmash.logging import set_quiet, error, notify, print_results, debug
 from sourmash import sourmash_args
+from sourmash.signature import (save_signatures_to_json,
+                                load_signatures_from_json)
 from sourmash.cli.utils import (add_moltype_args, add_ksize_arg)
-#from sourmash.sig import _check_abundance_compatibility
 
-def _check_abundance_compatibility(sig1, sig2):
-    if sig1.minhash.track_abundance != sig2.minhash.track_abundance:
-        raise ValueError("incompatible signatures: track_abundance is {} in first sig, {} in second".format(sig1.minhash.track_abundance, sig2.minhash.track_abundance))
+from masslib import (get_ident, count_idents, IdentReport, is_raw_zip,
+                     iter_raw_signatures, open_signature_output,
+                     ZipSignatureWriter, RawSignature, write_ident_reports,
+                     parse_selection, get_selection, format_selection,
+                     serialize_signature, SignatureFile, save_signature_file)
+
+
+def minhash_to_arrays(mh, *, flatten=False):
+    """
+    Return the hashes in 'mh' as a sorted uint64 array, along with their
+    abundances - or None, if 'mh' is flat or 'flatten' is set.
+    """
+    hashes = mh.hashes
+    hash_arr = np.fromiter(hashes.keys(), dtype=np.uint64, count=len(hashes))
+    if flatten or not mh.track_abundance:
+        return hash_arr, None
+
+    abund_arr = np.fromiter(hashes.values(), dtype=np.uint64,
+                            count=len(hashes))
+    return hash_arr, abund_arr
+
+
+def union_hashes(parts):
+    """
+    Union a list of (hashes, abundances) arrays from 'minhash_to_arrays',
+    summing abundances. Returns (hashes, abundances), sorted by hash.
+    """
+    hash_arr = np.concatenate([ h for (h, _) in parts ])
+    if parts[0][1] is None:
+        return np.unique(hash_arr), None
+
+    abund_arr = np.concatenate([ a for (_, a) in parts ])
+    if not len(hash_arr):
+        return hash_arr, abund_arr
+
+    order = np.argsort(hash_arr, kind='stable')
+    hash_arr = hash_arr[order]
+    abund_arr = abund_arr[order]
+
+    # sum the abundances for each run of identical hashes.
+    starts = np.flatnonzero(np.concatenate(([True],
+                                            hash_arr[1:] != hash_arr[:-1])))
+    return hash_arr[starts], np.add.reduceat(abund_arr, starts)
+
+
+class HashRun:
+    """
+    A sorted run of hashes, and maybe their abundances, saved to temporary
+    files in 'dirname'. Runs are written and read a chunk at a time.
+    """
+    def __init__(self, dirname, *, abund=False):
+        self.hash_file = self._make_file(dirname)
+        self.abund_file = self._make_file(dirname) if abund else None
+        self.length = 0
+
+    @staticmethod
+    def _make_file(dirname):
+        fd, filename = tempfile.mkstemp(suffix='.run', dir=dirname)
+        os.close(fd)
+        return filename
+
+    def __len__(self):
+        return self.length
+
+    def append(self, hash_arr, abund_arr=None):
+        with open(self.hash_file, 'ab') as fp:
+            hash_arr.tofile(fp)
+        if self.abund_file is not None:
+            with open(self.abund_file, 'ab') as fp:
+                abund_arr.tofile(fp)
+        self.length += len(hash_arr)
+
+    def read(self, start, stop):
+        "read the hashes from 'start' to 'stop', and their abundances."
+        count = max(0, min(stop, self.length) - start)
+        offset = start * np.dtype(np.uint64).itemsize
+        hash_arr = np.fromfile(self.hash_file, dtype=np.uint64,
+                               count=count, offset=offset)
+        abund_arr = None
+        if self.abund_file is not None:
+            abund_arr = np.fromfile(self.abund_file, dtype=np.uint64,
+                                    count=count, offset=offset)
+        return hash_arr, abund_arr
+
+    def iter_chunks(self, chunk_size):
+        for start in range(0, self.length, chunk_size):
+            yield self.read(start, start + chunk_size)
+
+    def remove(self):
+        os.unlink(self.hash_file)
+        if self.abund_file is not None:
+            os.unlink(self.abund_file)
+
+
+def iter_merged_runs(runs, *, max_memory=2**28):
+    """
+    Merge HashRuns a chunk at a time, using at most about 'max_memory'
+    bytes. Yields (hashes, abundances) chunks in hash order, with each
+    hash in exactly one chunk.
+    """
+    # reading and unioning a chunk from each run takes up to about 128
+    # bytes per hash.
+    chunk_size = max(1024, max_memory // (128 * max(1, len(runs))))
+    pos = [0] * len(runs)
+    while True:
+        chunks = {}
+        for i, run in enumerate(runs):
+            if pos[i] < len(run):
+                chunks[i] = run.read(pos[i], pos[i] + chunk_size)
+        if not chunks:
+            break
+
+        # everything up to the smallest of the last hashes in each run's
+        # next chunk can be merged now.
+        bound = min( hash_arr[-1] for (hash_arr, _) in chunks.values() )
+
+        parts = []
+        for i, (hash_arr, abund_arr) in chunks.items():
+            n = int(np.searchsorted(hash_arr, bound, side='right'))
+            if abund_arr is not None:
+                abund_arr = abund_arr[:n]
+            parts.append((hash_arr[:n], abund_arr))
+            pos[i] += n
+
+        yield union_hashes(parts)
+
+
+def parse_memory_size(value):
+    "parse a size such as '500M' or '4G' into bytes."
+    units = { 'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40 }
+    value = value.strip().upper().rstrip('B')
+    multiplier = 1
+    if value and value[-1] in units:
+        multiplier = units[value[-1]]
+        value = value[:-1]
+    return int(float(value) * multiplier)
+
+
+def signature_nbytes(ss):
+    "roughly how much memory a loaded or raw signature is using."
+    if isinstance(ss, RawSignature):
+        return len(ss.data)
+    return len(ss.minhash) * 16
+
+
+class MergeGroup:
+    """
+    Merge the signatures for one value of the merge column, as they are
+    found.
+
+    Singletons (one identifier) are not merged: the first signature found
+    is just renamed. Otherwise, all signatures are merged into one, with
+    the same parameters as the first signature.
+
+    With 'collect', the merged sketch is never built in memory. Instead,
+    hashes are collected as arrays, which 'spill' writes to disk as sorted
+    HashRuns; 'finish' then merges the runs a chunk at a time, and saves
+    the merged signature to a SignatureFile. Spilling a singleton saves
+    its signature. 'nbytes' is roughly the memory used for the group.
+
+    With 'scaled', signatures are downsampled to (at least) that scaled
+    before they are merged, or renamed.
+    """
+    def __init__(self, merge_name, num_idents, num_expected, *,
+                 flatten=False, collect=False, scaled=0):
+        self.merge_name = merge_name
+        self.num_idents = num_idents
+        self.num_expected = num_expected
+        self.num_seen = 0
+        self.flatten = flatten
+        self.collect = collect
+        self.scaled = scaled
+
+        self.first_sig = None
+        self.merged = None
+        self.mh = None
+        self.num_sigs = 0
+        self.parts = []
+        self.nbytes = 0
+        self.runs = []
+
+    def is_singleton(self):
+        return self.num_idents == 1
+
+    def _downsample(self, mh):
+        if self.scaled and mh.scaled < self.scaled:
+            mh = mh.downsample(scaled=self.scaled)
+        return mh
+
+    def is_complete(self):
+        return self.num_seen >= self.num_expected
+
+    def can_copy_raw(self, raw):
+        "can this RawSignature be saved without loading its sketch?"
+        if not self.is_singleton():
+            return False
+        return not self.scaled or int(raw.row['scaled']) >= self.scaled
+
+    def _check_sketch(self, mh):
+        """
+        check that 'mh' can be merged into this group; the first sketch
+        sets the parameters for the merged sketch, in 'self.mh'.
+        """
+        if self.mh is None:
+            self.mh = mh.copy_and_clear()
+
+            # forcibly remove abundance?
+            if self.flatten:
+                self.mh.track_abundance = False
+            return
+
+        if not self.flatten and mh.track_abundance != self.mh.track_abundance:
+            raise ValueError(f"incompatible signatures: track_abundance is {self.mh.track_abundance} in first sig, {mh.track_abundance} in second")
+        if self.collect and not self.mh.is_compatible(mh):
+            raise ValueError("incompatible signatures: different sketch parameters")
+
+    def add(self, ss, num_sigs=1):
+        """
+        add a signature, itself merged from 'num_sigs' signatures; return
+        True if it was used.
+        """
+        self.num_seen += 1
+
+        # if singleton, just keep the first.
+        if self.is_singleton():
+            if self.num_sigs:
+                return False
+            self.first_sig = ss
+            self.num_sigs += num_sigs
+            if self.collect:
+                self.nbytes += signature_nbytes(ss)
+            return True
+
+        if isinstance(ss, RawSignature):
+            if self.collect:
+                self._add_raw_hashes(ss)
+                self.num_sigs += num_sigs
+                return True
+            ss = ss.load()
+
+        sigobj_mh = self._downsample(ss.minhash)
+        self._check_sketch(sigobj_mh)
+        if self.flatten:
+            sigobj_mh.track_abundance = False
+
+        if self.collect:
+            hash_arr, abund_arr = minhash_to_arrays(sigobj_mh,
+                                                    flatten=self.flatten)
+            self._add_part(hash_arr, abund_arr)
+        else:
+            self.mh.merge(sigobj_mh)
+        self.num_sigs += num_sigs
+        return True
+
+    def _add_raw_hashes(self, raw):
+        "collect the hashes of a RawSignature, without loading its sketch."
+        ss, hashes, abunds = raw.load_hashes()
+        orig_mh = ss.minhash
+        mh = self._downsample(orig_mh)
+        self._check_sketch(mh)
+
+        hash_arr = np.array(hashes, dtype=np.uint64)
+        abund_arr = None
+        if abunds is not None and not self.flatten:
+            abund_arr = np.array(abunds, dtype=np.uint64)
+        if mh is not orig_mh:
+            keep = hash_arr <= mh._max_hash
+            hash_arr = hash_arr[keep]
+            if abund_arr is not None:
+                abund_arr = abund_arr[keep]
+        self._add_part(hash_arr, abund_arr)
+
+    def _add_part(self, hash_arr, abund_arr):
+        self.parts.append((hash_arr, abund_arr))
+        self.nbytes += hash_arr.nbytes
+        if abund_arr is not None:
+            self.nbytes += abund_arr.nbytes
+
+    def add_group(self, group):
+        "add the hashes of 'group', spilled or finished with 'keep_runs'."
+        self.num_seen += 1
+        self._check_sketch(self._downsample(group.mh))
+        self.runs.extend(group.runs)
+        group.runs = []
+        self.num_sigs += group.num_sigs
+
+    def set_merged(self, ss, num_sigs):
+        """
+        use 'ss', merged elsewhere from all 'num_sigs' signatures for this
+        group, as the merged signature.
+        """
+        self.merged = ss
+        self.num_seen = self.num_expected
+        self.num_sigs += num_sigs
+
+    def take_parts(self):
+        "return (and forget) the collected hash arrays."
+        parts, self.parts = self.parts, []
+        self.nbytes = 0
+        return parts
+
+    def spill(self, dirname):
+        "write the collected hashes, or the singleton signature, to disk."
+        if self.is_singleton():
+            if self.first_sig is not None:
+                fd, filename = tempfile.mkstemp(suffix='.sig.gz', dir=dirname)
+                os.close(fd)
+                self.merged = SignatureFile.save(filename,
+                                                 self.merged_signature())
+                self.first_sig = None
+                self.nbytes = 0
+            return
+
+        if self.parts:
+            hash_arr, abund_arr = union_hashes(self.take_parts())
+            run = HashRun(dirname, abund=abund_arr is not None)
+            run.append(hash_arr, abund_arr)
+            self.runs.append(run)
+
+    def finish(self, dirname, *, max_memory, keep_runs=False):
+        """
+        merge the collected hashes and spilled runs, a chunk at a time,
+        and save the merged signature to a SignatureFile. With
+        'keep_runs', the merged hashes are kept as a run, for 'add_group'.
+        """
+        self.spill(dirname)
+
+        # runs from other groups may not be downsampled yet.
+        max_hash = self.mh._max_hash
+        merged_run = HashRun(dirname, abund=self.mh.track_abundance)
+        for hash_arr, abund_arr in iter_merged_runs(self.runs,
+                                                    max_memory=max_memory):
+            n = len(hash_arr)
+            if max_hash:
+                n = int(np.searchsorted(hash_arr, max_hash, side='right'))
+            if self.mh.num:
+                n = min(n, self.mh.num - len(merged_run))
+            if abund_arr is not None:
+                abund_arr = abund_arr[:n]
+            merged_run.append(hash_arr[:n], abund_arr)
+
+        for run in self.runs:
+            run.remove()
+        self.runs = []
+
+        def iter_chunks():
+            for hash_arr, abund_arr in merged_run.iter_chunks(chunk_size):
+                if abund_arr is not None:
+                    abund_arr = abund_arr.tolist()
+                yield hash_arr.tolist(), abund_arr
+
+        # converting hashes to text takes a few hundred bytes per hash.
+        chunk_size = max(1024, max_memory // 1024)
+        merge_name = self.merge_name.replace(" ", "_")
+        fd, filename = tempfile.mkstemp(suffix='.sig.gz', dir=dirname)
+        os.close(fd)
+        self.merged = save_signature_file(filename,
+                            sourmash.SourmashSignature(self.mh, name=merge_name),
+                            iter_chunks)
+
+        if keep_runs:
+            self.runs = [merged_run]
+        else:
+            merged_run.remove()
+
+    def merged_signature(self):
+        if self.merged is not None:
+            return self.merged
+
+        # identifiers can't have spaces
+        merge_name = self.merge_name.replace(" ", "_")
+
+        if self.is_singleton():
+            ss = self.first_sig
+            if isinstance(ss, RawSignature):
+                return ss.renamed(merge_name)
+
+            ss = copy.copy(ss)
+            ss._name = merge_name
+
+            mh = self._downsample(ss.minhash)
+            if mh is not ss.minhash:
+                ss = sourmash.SourmashSignature(mh, name=merge_name,
+                                                filename=ss.filename)
+            return ss
+
+        return sourmash.SourmashSignature(self.mh, name=merge_name)
+
+
+def add_to_merge_group(group, ss, num_sigs=1):
+    "add 'ss' to 'group', or exit with an error if it cannot be merged."
+    try:
+        return group.add(ss, num_sigs)
+    except (TypeError, ValueError) as exc:
+        error(f"ERROR when merging signature '{ss}' ({ss.md5sum()[:8]})")
+        error(str(exc))
+        sys.exit(-1)
+
+
+def spill_biggest(groups, nbytes, *, max_memory, dirname):
+    """
+    Keep 'groups', using 'nbytes' in total, under their share of
+    'max_memory' by spilling the biggest of them to 'dirname' as needed.
+    Returns (bytes now used, number of groups spilled).
+    """
+    # unioning the hashes when they are spilled takes several times the
+    # memory of the hashes themselves.
+    limit = max_memory // 8
+    n_spilled = 0
+    if nbytes > limit:
+        for group in sorted(groups, key=lambda g: g.nbytes, reverse=True):
+            if nbytes <= limit // 2 or not group.nbytes:
+                break
+            nbytes -= group.nbytes
+            group.spill(dirname)
+            n_spilled += 1
+    return nbytes, n_spilled
+
+
+def split_merge_tasks(group_idents, jobs):
+    """
+    Split merge groups, given as (group, idents, num_sigs) in saving order,
+    into tasks for 'jobs' worker processes; each task is a list of
+    (group, idents). Small groups are packed together, and big groups
+    are split over several tasks, to be merged again afterwards.
+    """
+    total = sum( num_sigs for (_, _, num_sigs) in group_idents )
+    task_size = max(1, -(-total // (jobs * 4)))
+
+    task = []
+    task_sigs = 0
+    for group, idents, num_sigs in group_idents:
+        num_pieces = min(jobs, len(idents), num_sigs // task_size)
+        if num_pieces > 1:
+            for i in range(num_pieces):
+                yield [(group, idents[i::num_pieces])]
+            continue
+
+        task.append((group, idents))
+        task_sigs += num_sigs
+        if task_sigs >= task_size:
+            yield task
+            task = []
+            task_sigs = 0
+
+    if task:
+        yield task
+
+
+# databases loaded by each worker process, by filename.
+_worker_dbs = {}
+
+
+def merge_in_worker(dblist, ksize, moltype, task, *, flatten=False,
+                    max_memory=0, dirname=None):
+    """
+    Merge signatures for some merge groups in a worker process, loading
+    them from the databases in 'dblist'. 'task' is a list of
+    (merge_name, idents, num_idents, scaled, save_raw) for each group, where
+    'idents' may be only some of the group's 'num_idents' identifiers.
+
+    Returns a list of (result, number of signatures merged), one for each
+    group. With 'max_memory', hashes are spilled to disk in 'dirname' as
+    needed, and the result is the MergeGroup, with all of its hashes
+    spilled. Otherwise, the result is a RawSignature ready to save, with
+    'save_raw', or else the merged signature JSON.
+    """
+    picklist = SignaturePicklist('ident')
+    picklist.pickset = set()
+    groups = []
+    ident_to_group = {}
+    for merge_name, idents, num_idents, scaled, save_raw in task:
+        group = MergeGroup(merge_name, num_idents, len(idents),
+                           flatten=flatten, collect=bool(max_memory),
+                           scaled=scaled)
+        for ident in idents:
+            ident_to_group[ident] = group
+        picklist.pickset.update(idents)
+        groups.append(group)
+
+    mem_used = 0
+    for db in dblist:
+        idx = _worker_dbs.get(db)
+        if idx is None:
+            idx = _worker_dbs[db] = sourmash.load_file_as_index(db)
+
+        idx = idx.select(ksize=ksize, moltype=moltype, picklist=picklist)
+        if max_memory and is_raw_zip(idx):
+            sigs = iter_raw_signatures(idx)
+        else:
+            sigs = idx.signatures()
+
+        for ss in sigs:
+            group = ident_to_group[get_ident(ss.name)]
+            group_nbytes = group.nbytes
+            add_to_merge_group(group, ss)
+            if max_memory:
+                mem_used += group.nbytes - group_nbytes
+                mem_used, _ = spill_biggest(groups, mem_used,
+                                            max_memory=max_memory,
+                                            dirname=dirname)
+
+    results = []
+    for group, (*_, save_raw) in zip(groups, task):
+        if max_memory:
+            group.spill(dirname)
+            result = group
+        elif save_raw:
+            row, data, _ = serialize_signature(group.merged_signature())
+            result = RawSignature(row, data)
+        else:
+            result = save_signatures_to_json([group.merged_signature()])
+        results.append((result, group.num_sigs))
+    return results
 
 
 def massmerge(args):
@@ -33,10 +562,49 @@ def massmerge(args):
     """
     set_quiet(args.quiet, args.debug)
     moltype = sourmash_args.calculate_moltype(args)
-    merge_col = args.merge_col
+    merge_cols = args.merge_col
+    selections = list(dict.fromkeys(args.select)) or [(args.ksize, moltype)]
+
+    if len(merge_cols) > 1 and '{merge_col}' not in args.output:
+        error("ERROR: with more than one --merge-col, the output filename must contain '{{merge_col}}'.")
+        sys.exit(-1)
 
-    # load spreadsheets
-    merge_d = defaultdict(list)
+    # figure out what to downsample to: --scaled sets a default, or a
+    # value per merge column; --scaled-by-size raises it for big groups.
+    default_scaled = 0
+    scaled_by_col = {}
+    for value in args.scaled:
+        merge_col, _, scaled = value.rpartition(':')
+        if not scaled.isdigit() or int(scaled) < 1:
+            error(f"ERROR: cannot parse --scaled '{value}'.")
+            sys.exit(-1)
+        if not merge_col:
+            default_scaled = int(scaled)
+        elif merge_col in merge_cols:
+            scaled_by_col[merge_col] = int(scaled)
+        else:
+            error(f"ERROR: --scaled '{value}' is not for any --merge-col.")
+            sys.exit(-1)
+
+    scaled_by_size = []
+    for value in args.scaled_by_size:
+        min_idents, _, scaled = value.partition(':')
+        if not (min_idents.isdigit() and scaled.isdigit()) or int(scaled) < 1:
+            error(f"ERROR: cannot parse --scaled-by-size '{value}'.")
+            sys.exit(-1)
+        scaled_by_size.append((int(min_idents), int(scaled)))
+
+    def choose_scaled(merge_col, num_idents):
+        scaled = scaled_by_col.get(merge_col, default_scaled)
+        for min_idents, size_scaled in scaled_by_size:
+            if num_idents >= min_idents:
+                scaled = max(scaled, size_scaled)
+        return scaled
+
+    # load spreadsheets; each merge column after the first is a higher rank
+    # that groups the values of the one before.
+    merge_ds = [ defaultdict(list) for merge_col in merge_cols ]
+    parent_names = [ {} for merge_col in merge_cols[1:] ]
     all_idents=set()
     for filename in args.from_spreadsheet:
         count = 0
@@ -45,27 +613,40 @@ def massmerge(args):
             r = csv.DictReader(fp)
             for row in r:
                 if first_entry:
-                    if not merge_col in r.fieldnames:
-                        error(f"ERROR on spreadsheet '{filename}'.")
-                        error(f"Merge column {merge_col} is not present.")
-                        sys.exit(-1)
+                    for merge_col in merge_cols:
+                        if not merge_col in r.fieldnames:
+                            error(f"ERROR on spreadsheet '{filename}'.")
+                            error(f"Merge column {merge_col} is not present.")
+                            sys.exit(-1)
                     first_entry=False
-                merge_name = row[merge_col]
+                merge_names = [ row[merge_col] for merge_col in merge_cols ]
                 ident = row['ident']
 
                 assert ' ' not in ident, f"identifiers cannot have spaces - but '{ident}' does."
                 assert ident not in all_idents, f"duplicate identifer: '{ident}'"
                 all_idents.add(ident)
 
-                merge_d[merge_name].append(ident)
+                for merge_d, merge_name in zip(merge_ds, merge_names):
+                    merge_d[merge_name].append(ident)
+
+                for rank, parents in enumerate(parent_names):
+                    merge_name, parent_name = merge_names[rank:rank + 2]
+                    previous = parents.setdefault(merge_name, parent_name)
+                    if previous != parent_name:
+                        error(f"ERROR on spreadsheet '{filename}'.")
+                        error(f"{merge_cols[rank]} '{merge_name}' is in more than one {merge_cols[rank + 1]}: '{previous}' and '{parent_name}'.")
+                        sys.exit(-1)
                 count += 1
         notify(f"loaded {count} identifiers from '{filename}'")
 
-    num_merge_names = len(merge_d)
-    notify(f"found a total of {num_merge_names} distinct values for signature merging.")
+    for merge_col, merge_d in zip(merge_cols, merge_ds):
+        num_merge_names = len(merge_d)
+        notify(f"found a total of {num_merge_names} distinct values for signature merging by column: {merge_col}")
 
-    # load each db and check that we can find all idents
-    found_idents = set()
+    # load each db and check that we can find all idents for each
+    # selection, using only the manifests.
+    reports = [ IdentReport(all_idents, ksize=ksize, moltype=moltype)
+                for (ksize, moltype) in selections ]
     idx_list = []
     for db in args.dblist:
         notify(f"loading index '{db}'")
@@ -77,18 +658,23 @@ def massmerge(args):
             error("No manifest, but a manifest is required.")
             sys.exit(-1)
 
-        ident_picklist = SignaturePicklist('ident')
-        ident_picklist.pickset = all_idents
-        check_idx = idx.select(ksize=args.ksize,
-                                moltype=moltype,
-                                picklist=ident_picklist)
-        # do we need to do any checks for duplicate idents between dbs?
-        found_idents.update(ident_picklist.found)
-        idx_list.append(check_idx)
+        for report in reports:
+            report.add(db, count_idents(manifest, all_idents,
+                                        ksize=report.ksize,
+                                        moltype=report.moltype))
+        idx_list.append(idx)
+
+    for report in reports:
+        report.notify_summary()
+    if args.report_errors_to:
+        write_ident_reports(args.report_errors_to, reports)
+        notify(f"wrote identifier report to '{args.report_errors_to}'")
 
     # make sure that we get all the things.
-    if not all_idents.issubset(found_idents):
-        remaining = all_idents - found_idents
+    remaining = set()
+    for report in reports:
+        remaining.update(report.missing())
+    if remaining:
         error(f"ERROR: {len(remaining)} identifiers from spreadsheet not found.")
         example_missing = "\n".join(remaining)
         error(f"Here are some examples: {example_missing}")
@@ -100,69 +686,295 @@ def massmerge(args):
 
     notify("Everything looks copacetic. Proceeding to merge!")
 
-    # go through, do merge, save.
-    with sourmash_args.SaveSignaturesToLocation(args.output) as save_sigs:
-        n=0
-        n_singletons = 0
-        for m, (merge_name, idents) in enumerate(merge_d.items()):
-            # identifiers can't have spaces
-            merge_name = merge_name.replace(" ", "_")
-
-            if m % 100 == 0:
-                merge_percent = float(n)/len(found_idents) * 100
-                notify(f"...merging sigs for {merge_name} ({merge_percent:.1f}% of sigs merged)", end="\r")
-
-            # build a new picklist for idents to be merged
-            ident_picklist = SignaturePicklist('ident')
-            ident_picklist.pickset = set(idents)
-
-            # if singleton, just rename
-            if len(idents) == 1:
-                n_singletons+=1
-                this_idx = idx_list[0].select(picklist=ident_picklist)
-                ss = next(this_idx.signatures())
-                ss._name = merge_name
-                save_sigs.add(ss)
-                n+=1
+    def select_idents(idents):
+        "select the signatures for these identifiers from each database."
+        ident_picklist = SignaturePicklist('ident')
+        ident_picklist.pickset = idents
+        if len(selections) == 1:
+            (ksize, moltype), = selections
+            return [ idx.select(ksize=ksize, moltype=moltype,
+                                picklist=ident_picklist)
+                     for idx in db_list ]
+        return [ idx.select(picklist=ident_picklist) for idx in db_list ]
+
+    db_list = idx_list
+    idx_list = select_idents(all_idents)
+
+    # with several selections, each is merged separately, in one pass
+    # through the databases.
+    selection_nums = { sel: i for i, sel in enumerate(selections) }
+
+    def get_selection_num(ss):
+        if len(selections) == 1:
+            return 0
+        return selection_nums.get(get_selection(ss))
+
+    # map each identifier to its merge group, and count how many
+    # signatures each group should get, so that groups can be saved
+    # as soon as they are complete. Groups at higher ranks get the
+    # merged signatures of the groups below them.
+    ident_to_merge_name = {}
+    for merge_name, idents in merge_ds[0].items():
+        for ident in idents:
+            ident_to_merge_name[ident] = merge_name
+
+    num_sigs_expected = [ defaultdict(int) for sel in selections ]
+    for idx in idx_list:
+        for row in idx.manifest.rows:
+            if len(selections) == 1:
+                i = 0
             else:
-                # otherwise, loop through each idx (db), select sigs, merge mh
-                first_sig = None
-                mh = None
-                merged_ss = None
-                for idx in idx_list:
-                    this_idx = idx.select(picklist=ident_picklist)
-                    for ss in this_idx.signatures():
-                        n += 1
-                        # first sig? initialize some things
-                        if first_sig is None:
-                            first_sig = ss
-                            mh = first_sig.minhash.copy_and_clear()
-
-                            # forcibly remove abundance?
-                            if args.flatten:
-                                mh.track_abundance = False
-
-                        try:
-                            sigobj_mh = ss.minhash
-                            if not args.flatten:
-                                _check_abundance_compatibility(first_sig, ss)
-                            else:
-                                sigobj_mh.track_abundance = False
-
-                            mh.merge(sigobj_mh)
-                        except (TypeError, ValueError) as exc:
-                            error(f"ERROR when merging signature '{ss}' ({ss.md5sum()[:8]})")
-                            error(str(exc))
-                            sys.exit(-1)
+                i = selection_nums.get((row['ksize'], row['moltype']))
+                if i is None:
+                    continue
+            if not row['scaled'] and (args.scaled or args.scaled_by_size):
+                error(f"ERROR: '{row['name']}' is a num sketch, which cannot be downsampled with --scaled or --scaled-by-size.")
+                sys.exit(-1)
+            merge_name = ident_to_merge_name[get_ident(row['name'])]
+            num_sigs_expected[i][merge_name] += 1
+    num_sigs_total = sum( sum(d.values()) for d in num_sigs_expected )
+
+    # merge groups are kept by level: one level per merge column, for each
+    # selection in turn.
+    num_ranks = len(merge_cols)
+    collect = bool(args.max_memory)
+    groups = []
+    for num_expected in num_sigs_expected:
+        for rank, merge_d in enumerate(merge_ds):
+            if rank > 0:
+                num_expected = defaultdict(int)
+                for parent_name in parent_names[rank - 1].values():
+                    num_expected[parent_name] += 1
+
+            rank_groups = {}
+            for merge_name, idents in merge_d.items():
+                scaled = choose_scaled(merge_cols[rank], len(idents))
+                rank_groups[merge_name] = MergeGroup(merge_name, len(idents),
+                                                     num_expected[merge_name],
+                                                     flatten=args.flatten,
+                                                     collect=collect,
+                                                     scaled=scaled)
+
+            # merged signatures from the rank below can't be upsampled.
+            if rank > 0:
+                for child_name, parent_name in parent_names[rank - 1].items():
+                    parent = rank_groups[parent_name]
+                    child = groups[-1][child_name]
+                    parent.scaled = max(parent.scaled, child.scaled)
+
+            groups.append(rank_groups)
+
+    # with -j, split the groups to merge into tasks for worker processes;
+    # their results are merged into the groups here, like signatures.
+    executor = None
+    tasks = deque()
+    if args.jobs > 1:
+        for i, selection in enumerate(selections):
+            level_groups = groups[i * num_ranks]
+            group_idents = [ (group, merge_ds[0][merge_name],
+                              num_sigs_expected[i][merge_name])
+                             for merge_name, group in level_groups.items()
+                             if not group.is_singleton() ]
+            for task in split_merge_tasks(group_idents, args.jobs):
+                tasks.append((selection, task))
 
-                # create merged sig and write to output
-                merged_ss = sourmash.SourmashSignature(mh, name=merge_name)
+        num_tasks = Counter( group for (_, task) in tasks
+                             for (group, _) in task )
+        for group, num_expected in num_tasks.items():
+            group.num_expected = num_expected
+
+        # only singletons are loaded here.
+        idx_list = select_idents({ idents[0] for idents in merge_ds[0].values()
+                                   if len(idents) == 1 })
+
+        executor = ProcessPoolExecutor(max_workers=args.jobs)
+
+    # with --max-memory, spill collected hashes to disk as needed; with
+    # -j, the memory is shared with the worker processes.
+    spill_dir = None
+    max_memory = args.max_memory
+    mem_used = 0
+    n_spilled = 0
+    if max_memory:
+        spill_dir = tempfile.TemporaryDirectory(prefix='mass-merge-',
+                                                dir=args.tmpdir)
+        if args.jobs > 1:
+            max_memory //= args.jobs + 1
+
+    def add_to_group(group, ss, num_sigs=1):
+        nonlocal mem_used, n_spilled
+        group_nbytes = group.nbytes
+        is_used = add_to_merge_group(group, ss, num_sigs)
+        mem_used += group.nbytes - group_nbytes
+
+        # over budget? spill the biggest groups to disk.
+        if max_memory:
+            all_groups = [ g for rank_groups in groups
+                           for g in rank_groups.values() ]
+            mem_used, n = spill_biggest(all_groups, mem_used,
+                                        max_memory=max_memory,
+                                        dirname=spill_dir.name)
+            n_spilled += n
+
+        return is_used
+
+    # go through each db once, routing each signature to its merge group;
+    # save completed groups in spreadsheet order.
+    with contextlib.ExitStack() as stack:
+        outputs = {}
+        save_sigs_list = []
+        for ksize, moltype in selections:
+            for merge_col in merge_cols:
+                output = args.output.replace('{merge_col}', merge_col)
+                if args.select:
+                    output = format_selection(output, ksize, moltype)
+                if output not in outputs:
+                    save_sigs = open_signature_output(output,
+                                                      jobs=args.write_jobs)
+                    outputs[output] = stack.enter_context(save_sigs)
+                save_sigs_list.append(outputs[output])
+
+        # singletons from zip collections can be copied into zip output
+        # with just the name changed, if they aren't merged further.
+        raw_output = (num_ranks == 1 and
+                      all( isinstance(save_sigs, ZipSignatureWriter)
+                           for save_sigs in outputs.values() ))
+
+        n=0
+        n_merged = [0] * len(groups)
+        n_saved = [0] * len(groups)
+        n_singletons = [0] * len(groups)
+        to_save = [ deque(level_groups.values()) for level_groups in groups ]
+
+        def save_completed(level=0):
+            nonlocal mem_used
+            rank = level % num_ranks
+            while to_save[level] and to_save[level][0].is_complete():
+                group = to_save[level].popleft()
+                mem_used -= group.nbytes
+                if (group.collect and not group.is_singleton() and
+                    group.merged is None):
+                    group.finish(spill_dir.name, max_memory=max_memory,
+                                 keep_runs=rank + 1 < num_ranks)
+
+                if group.is_singleton():
+                    n_singletons[level] += 1
+                merged_ss = group.merged_signature()
+                save_sigs = save_sigs_list[level]
+                if (isinstance(merged_ss, SignatureFile) and
+                    not isinstance(save_sigs, ZipSignatureWriter)):
+                    merged_ss = merged_ss.load()
                 save_sigs.add(merged_ss)
-            merge_percent = float(n)/len(found_idents) * 100
-            notify(f"...merged {len(idents)} sigs for {merge_name} ({merge_percent:.1f}% of sigs merged)", end="\r")
+                n_merged[level] += group.num_sigs
+                n_saved[level] += 1
+                del groups[level][group.merge_name]
+
+                if rank == 0:
+                    merge_percent = float(n)/num_sigs_total * 100
+                    notify(f"...merged {group.num_idents} sigs for {group.merge_name} ({merge_percent:.1f}% of sigs merged)", end="\r")
+
+                # pass the merged signature, or its hashes, up to the next
+                # rank.
+                if rank + 1 < num_ranks:
+                    parent_name = parent_names[rank][group.merge_name]
+                    parent = groups[level + 1][parent_name]
+                    if group.runs:
+                        parent.add_group(group)
+                    else:
+                        if isinstance(merged_ss, SignatureFile):
+                            merged_ss = merged_ss.load()
+                        add_to_group(parent, merged_ss, group.num_sigs)
+
+                if isinstance(group.merged, SignatureFile):
+                    os.unlink(group.merged.filename)
+
+            if rank + 1 < num_ranks:
+                save_completed(level + 1)
+
+        def save_all_completed():
+            for level in range(0, len(groups), num_ranks):
+                save_completed(level)
 
-        notify(f"merged {n} signatures into {len(save_sigs)} signatures by column: {merge_col}")
-        notify(f"  of these, {n_singletons} were singletons (no merge; just renamed)")
+        # keep a few tasks per worker running, and merge in their results
+        # in order.
+        running = deque()
+
+        def run_tasks(*, wait=False):
+            nonlocal n
+            while True:
+                while tasks and len(running) < args.jobs * 2:
+                    (ksize, moltype), task = tasks.popleft()
+                    # groups merged by a single task can be saved as is.
+                    task_args = [ (group.merge_name, idents, group.num_idents,
+                                   group.scaled,
+                                   raw_output and group.num_expected == 1)
+                                  for (group, idents) in task ]
+                    future = executor.submit(merge_in_worker, args.dblist,
+                                             ksize, moltype, task_args,
+                                             flatten=args.flatten,
+                                             max_memory=max_memory,
+                                             dirname=spill_dir and spill_dir.name)
+                    running.append((task, future))
+
+                if not running or not (wait or running[0][1].done()):
+                    break
+
+                task, future = running.popleft()
+                for (group, _), (result, num_sigs) in zip(task,
+                                                          future.result()):
+                    if isinstance(result, MergeGroup):
+                        group.add_group(result)
+                    elif isinstance(result, RawSignature):
+                        group.set_merged(result, num_sigs)
+                    else:
+                        ss, = load_signatures_from_json(result)
+                        add_to_group(group, ss, num_sigs)
+                    n += num_sigs
+                save_all_completed()
+
+        # with --max-memory, zip collections are read raw as well, to
+        # keep them out of memory; see 'iter_raw_signatures'.
+        for idx in idx_list:
+            if (raw_output or max_memory) and is_raw_zip(idx):
+                sigs = iter_raw_signatures(idx)
+            else:
+                sigs = idx.signatures()
+
+            for ss in sigs:
+                i = get_selection_num(ss)
+                if i is None:
+                    continue
+
+                merge_name = ident_to_merge_name[get_ident(ss.name)]
+                group = groups[i * num_ranks][merge_name]
+                # non-singletons load RawSignatures as they are added.
+                if (isinstance(ss, RawSignature) and group.is_singleton() and
+                    not (raw_output and group.can_copy_raw(ss))):
+                    ss = ss.load()
+                if add_to_group(group, ss):
+                    n += 1
+
+                run_tasks()
+                save_all_completed()
+
+        run_tasks(wait=True)
+        save_all_completed()
+        if executor is not None:
+            executor.shutdown()
+        if spill_dir is not None:
+            spill_dir.cleanup()
+            if n_spilled:
+                notify(f"spilled hashes to disk {n_spilled} times to stay under --max-memory")
+        assert not any(groups), f"{sum(map(len, groups))} merge groups were never completed"
+
+        for level in range(len(groups)):
+            merge_col = merge_cols[level % num_ranks]
+            ksize, moltype = selections[level // num_ranks]
+            prefix = ""
+            if len(selections) > 1:
+                prefix = f"{moltype} k={ksize}: "
+            notify(f"{prefix}merged {n_merged[level]} signatures into {n_saved[level]} signatures by column: {merge_col}")
+            notify(f"  of these, {n_singletons[level]} were singletons (no merge; just renamed)")
 
 
 def main():
@@ -177,12 +989,12 @@ def main():
         '-d', '--debug', action='store_true',
     )
     p.add_argument(
-        '--merge-col', required=True,
-        help='the column to merge signatures by (required)'
+        '--merge-col', required=True, action='append',
+        help="the column to merge signatures by (required); may be given multiple times, from lowest to highest rank, e.g. '--merge-col species --merge-col genus', in which case '-o' must contain '{merge_col}'"
     )
     p.add_argument(
         '-o', '--output', metavar='FILE', default='-',
-        help='output merged database to this file (default stdout)'
+        help="output merged database to this file (default stdout); '{merge_col}' is replaced by the merge column"
     )
     p.add_argument(
         '--flatten', action='store_true',
@@ -196,10 +1008,43 @@ def main():
         '--check', action='store_true',
         help='Just check for ability to merge; do not actually merge signatures.'
     )
+    p.add_argument(
+        '-R', '--report-errors-to', metavar='FILE',
+        help='write missing, duplicated, and ambiguous identifiers to this CSV file'
+    )
     p.add_argument('-F', '--from-spreadsheet',
                    required=True,
                    action='append', default=[],
                    help="input spreadsheet containing 'ident' and '--merge-col` columns")
+    p.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='number of processes to use for loading and merging signatures (default 1)'
+    )
+    p.add_argument(
+        '--select', metavar='MOLTYPE:KSIZE', action='append', default=[],
+        type=parse_selection,
+        help="merge sketches with this moltype and ksize, e.g. 'DNA:31' or 'protein:10', instead of those selected by -k and the moltype options; may be given multiple times, reading each database once. '{ksize}' and '{moltype}' in '-o' are replaced, to save each selection separately"
+    )
+    p.add_argument(
+        '--write-jobs', type=int, default=1,
+        help='number of threads to use for compressing signatures into .zip output (default 1)'
+    )
+    p.add_argument(
+        '--max-memory', type=parse_memory_size,
+        help="approximate memory to use for merging, e.g. '4G', on top of the databases' manifests and loading one signature at a time; hashes are merged in temporary files to stay under it, and merged signatures are saved to .zip output without loading them"
+    )
+    p.add_argument(
+        '--tmpdir',
+        help='with --max-memory, put temporary files here'
+    )
+    p.add_argument(
+        '--scaled', action='append', default=[],
+        help="downsample signatures to this scaled before merging, either for all merge columns, e.g. '1000', or for one, e.g. 'genus:10000'; may be given multiple times"
+    )
+    p.add_argument(
+        '--scaled-by-size', action='append', default=[],
+        help="downsample merge groups with at least this many identifiers to at least this scaled, e.g. '1000:50000'; may be given multiple times"
+    )
 
     add_ksize_arg(p, 31)
     add_moltype_args(p)
@@ -8,10 +8,14 @@ and renames all of the matching signatures in the databases.
 The spreadsheet must contain two columns, 'ident' and 'name'; signatures
 are selected based on 'ident' and renamed to 'name'. Conveniently this is
 the same format as the fromfile format :).
+
+`--select` (e.g. `--select DNA:31 --select protein:10`) renames several
+ksize/moltype combinations while reading each database only once.
 """
 import sys
 import argparse
 import csv
+import contextlib
 
 import sourmash
 
@@ -20,6 +24,11 @@ from sourmash.logging import set_quiet, error, notify, print_results, debug
 from sourmash import sourmash_args
 from sourmash.cli.utils import (add_moltype_args, add_ksize_arg)
 
+from masslib import (get_ident, count_idents, IdentReport, is_raw_zip,
+                     iter_raw_signatures, open_signature_output,
+                     ZipSignatureWriter, RawSignature, write_ident_reports,
+                     parse_selection, get_selection, format_selection)
+
 
 def massrename(args):
     """
@@ -27,6 +36,7 @@ def massrename(args):
     """
     set_quiet(args.quiet, args.quiet)
     moltype = sourmash_args.calculate_moltype(args)
+    selections = list(dict.fromkeys(args.select)) or [(args.ksize, moltype)]
     #CTB _extend_signatures_with_from_file(args)
 
     # load spreadsheets
@@ -53,7 +63,10 @@ def massrename(args):
     ident_picklist = SignaturePicklist('ident')
     ident_picklist.pickset = rename_set
 
-    # go through all the database and load etc.
+    # go through all the database and load etc., checking that we can
+    # find all idents for each selection using only the manifests.
+    reports = [ IdentReport(rename_set, ksize=ksize, moltype=moltype)
+                for (ksize, moltype) in selections ]
     idx_list = []
     for db in args.dblist:
         notify(f"loading index '{db}'")
@@ -65,16 +78,23 @@ def massrename(args):
             error("No manifest, but a manifest is required.")
             sys.exit(-1)
 
-        idx = idx.select(ksize=args.ksize,
-                         moltype=moltype,
-                         picklist=ident_picklist)
-
+        for report in reports:
+            report.add(db, count_idents(manifest, rename_set,
+                                        ksize=report.ksize,
+                                        moltype=report.moltype))
         idx_list.append(idx)
 
+    for report in reports:
+        report.notify_summary()
+    if args.report_errors_to:
+        write_ident_reports(args.report_errors_to, reports)
+        notify(f"wrote identifier report to '{args.report_errors_to}'")
+
     # make sure that we get all the things.
-    to_rename = set(rename_d.keys())
-    if not to_rename.issubset(ident_picklist.found):
-        remaining = to_rename - ident_picklist.found
+    remaining = set()
+    for report in reports:
+        remaining.update(report.missing())
+    if remaining:
         error(f"ERROR: {len(remaining)} identifiers from spreadsheet not found.")
         example_missing = "\n".join(remaining)
         error(f"Here are some examples: {example_missing}")
@@ -82,21 +102,66 @@ def massrename(args):
 
     notify("Everything looks copacetic. Proceeding to rename!")
 
-    # go through, do rename, save.
-    with sourmash_args.SaveSignaturesToLocation(args.output) as save_sigs:
+    # go through, do rename, save. Each database is read once, with each
+    # selection saved to its own output if '-o' contains '{ksize}' or
+    # '{moltype}'. When saving to a zip file, signatures in zip collections
+    # are copied with only the name changed, without loading the sketches.
+    with contextlib.ExitStack() as stack:
+        outputs = {}
+        save_sigs_d = {}
+        for ksize, moltype in selections:
+            output = args.output
+            if args.select:
+                output = format_selection(output, ksize, moltype)
+            if output not in outputs:
+                save_sigs = open_signature_output(output,
+                                                  jobs=args.write_jobs)
+                outputs[output] = stack.enter_context(save_sigs)
+            save_sigs_d[(ksize, moltype)] = outputs[output]
+
+        raw_output = all( isinstance(save_sigs, ZipSignatureWriter)
+                          for save_sigs in outputs.values() )
         n = 0
         for idx in idx_list:
-            for ss in idx.signatures():
+            if len(selections) == 1:
+                (ksize, moltype), = selections
+                idx = idx.select(ksize=ksize, moltype=moltype,
+                                 picklist=ident_picklist)
+            else:
+                idx = idx.select(picklist=ident_picklist)
+
+            if raw_output and is_raw_zip(idx):
+                sigs = iter_raw_signatures(idx)
+            else:
+                sigs = idx.signatures()
+
+            for ss in sigs:
+                if len(selections) == 1:
+                    save_sigs, = save_sigs_d.values()
+                else:
+                    save_sigs = save_sigs_d.get(get_selection(ss))
+                    if save_sigs is None:
+                        continue
+
                 n += 1
                 if n % 100 == 0:
                     notify(f"...at signature {n}", end="\r")
-                ident = ss.name.split(' ')[0]
+                ident = get_ident(ss.name)
                 new_name = rename_d[ident]
-                ss._name = new_name
+
+                if isinstance(ss, RawSignature):
+                    ss = ss.renamed(new_name)
+                else:
+                    ss._name = new_name
 
                 save_sigs.add(ss)
 
-    notify(f"rename {len(save_sigs)} signatures")
+    for output, save_sigs in outputs.items():
+        notify(f"rename {len(save_sigs)} signatures into '{output}'")
+    n_copied = sum( getattr(save_sigs, 'n_copied', 0)
+                    for save_sigs in outputs.values() )
+    if n_copied:
+        notify(f"({n_copied} copied without loading sketches)")
 
 
 def main():
@@ -119,6 +184,21 @@ def main():
                    required=True,
                    action='append', default=[],
                    help="input spreadsheet containing 'ident' and 'name' columns")
+    p.add_argument(
+        '-R', '--report-errors-to', metavar='FILE',
+        help='write missing, duplicated, and ambiguous identifiers to this CSV file'
+    )
+
+    p.add_argument(
+        '--write-jobs', type=int, default=1,
+        help='number of threads to use for compressing signatures into .zip output (default 1)'
+    )
+
+    p.add_argument(
+        '--select', metavar='MOLTYPE:KSIZE', action='append', default=[],
+        type=parse_selection,
+        help="rename sketches with this moltype and ksize, e.g. 'DNA:31' or 'protein:10', instead of those selected by -k and the moltype options; may be given multiple times, reading each database once. '{ksize}' and '{moltype}' in '-o' are replaced, to save each selection separately"
+    )
 
     add_ksize_arg(p, 31)
     add_moltype_args(p)
@@ -0,0 +1,785 @@
+"""
+Support code for mass-rename.py, mass-merge.py, and sigs-to-manifest.py.
+"""
+import os
+import csv
+import argparse
+import gzip
+import hashlib
+import json
+import re
+import zipfile
+from io import StringIO
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from sourmash.logging import notify
+from sourmash import sourmash_args
+from sourmash.index import ZipFileLinearIndex
+from sourmash.index.sqlite_index import SqliteCollectionManifest
+from sourmash.manifest import CollectionManifest
+from sourmash.minhash import _get_scaled_for_max_hash
+from sourmash.signature import (save_signatures_to_json,
+                                load_signatures_from_json)
+
+
+def get_ident(name):
+    "the identifier for a signature name, as used by 'ident' picklists."
+    return name.split(' ')[0]
+
+
+def count_idents(manifest, idents, *, ksize=None, moltype=None):
+    """
+    Count the sketches in 'manifest' with the given ksize and moltype for
+    each identifier in 'idents', without loading any signatures. Returns a
+    dict { ident: count } for the identifiers that are present.
+
+    For SQL manifests, the counting is done in the database.
+    """
+    if (isinstance(manifest, SqliteCollectionManifest) and
+        not manifest.selection_dict):
+        return _count_idents_sql(manifest.conn, idents,
+                                 ksize=ksize, moltype=moltype)
+
+    counts = defaultdict(int)
+    for row in manifest.rows:
+        if ksize and row['ksize'] != ksize:
+            continue
+        if moltype and row['moltype'] != moltype:
+            continue
+        ident = get_ident(row['name'])
+        if ident in idents:
+            counts[ident] += 1
+
+    return dict(counts)
+
+
+def _count_idents_sql(conn, idents, *, ksize=None, moltype=None):
+    c = conn.cursor()
+    c.execute("DROP TABLE IF EXISTS temp.masslib_idents")
+    c.execute("""
+    CREATE TEMPORARY TABLE masslib_idents (ident TEXT PRIMARY KEY)
+    WITHOUT ROWID
+    """)
+    c.executemany("INSERT OR IGNORE INTO masslib_idents (ident) VALUES (?)",
+                  ( (ident,) for ident in idents ))
+
+    conditions = []
+    values = []
+    if ksize:
+        conditions.append("ksize = ?")
+        values.append(ksize)
+    if moltype:
+        conditions.append("moltype = ?")
+        values.append(moltype)
+    where = ""
+    if conditions:
+        where = "WHERE " + " AND ".join(conditions)
+
+    # the identifier is the name up to the first space, as in get_ident.
+    c.execute(f"""
+    SELECT ident, COUNT(*) FROM
+      (SELECT CASE WHEN instr(name, ' ') > 0
+                   THEN substr(name, 1, instr(name, ' ') - 1)
+                   ELSE name END AS ident
+       FROM sourmash_sketches {where})
+    JOIN masslib_idents USING (ident)
+    GROUP BY ident
+    """, values)
+    counts = dict(c)
+
+    c.execute("DROP TABLE temp.masslib_idents")
+    return counts
+
+
+class IdentReport:
+    """
+    Track where identifiers were found across a list of databases, from
+    'count_idents', and report those that are missing, found in more than
+    one database (duplicated), or matched by more than one sketch within a
+    database (ambiguous). 'ksize' and 'moltype' label the sketches counted;
+    a moltype of None means any moltype.
+    """
+    def __init__(self, idents, *, ksize=None, moltype=None):
+        self.idents = idents
+        self.ksize = ksize
+        self.moltype = moltype
+        self.found_in = defaultdict(list)
+
+    def add(self, location, counts):
+        for ident, count in counts.items():
+            self.found_in[ident].append((location, count))
+
+    @property
+    def found(self):
+        return set(self.found_in)
+
+    def missing(self):
+        return set(self.idents) - self.found_in.keys()
+
+    def duplicated(self):
+        return { ident for ident, where in self.found_in.items()
+                 if len(where) > 1 }
+
+    def ambiguous(self):
+        return { ident for ident, where in self.found_in.items()
+                 if any( count > 1 for (_, count) in where ) }
+
+    def problem_rows(self):
+        "yield one CSV row per problem identifier."
+        moltype = self.moltype or 'any'
+        for ident in sorted(self.missing()):
+            yield ['missing', ident, self.ksize, moltype, '', 0]
+        for problem, idents in (('duplicated', self.duplicated()),
+                                ('ambiguous', self.ambiguous())):
+            for ident in sorted(idents):
+                where = self.found_in[ident]
+                yield [problem, ident, self.ksize, moltype,
+                       ";".join( location for (location, _) in where ),
+                       sum( count for (_, count) in where )]
+
+    def notify_summary(self):
+        prefix = ""
+        if self.moltype:
+            prefix = f"{self.moltype} k={self.ksize}: "
+        notify(f"{prefix}found {len(self.found_in)} of {len(self.idents)} identifiers.")
+        num_duplicated = len(self.duplicated())
+        if num_duplicated:
+            notify(f"WARNING: {prefix}{num_duplicated} identifiers were found in more than one database.")
+        num_ambiguous = len(self.ambiguous())
+        if num_ambiguous:
+            notify(f"WARNING: {prefix}{num_ambiguous} identifiers matched more than one sketch in a database.")
+
+
+def write_ident_reports(filename, reports):
+    "write the problem identifiers from several IdentReports to a CSV file."
+    with open(filename, 'w', newline='') as fp:
+        w = csv.writer(fp)
+        w.writerow(['problem', 'ident', 'ksize', 'moltype', 'databases',
+                    'num_sketches'])
+        for report in reports:
+            w.writerows(report.problem_rows())
+
+
+# moltype names, as found in manifests.
+MOLTYPES = { 'dna': 'DNA', 'protein': 'protein', 'dayhoff': 'dayhoff',
+             'hp': 'hp' }
+
+
+def parse_selection(value):
+    "parse a sketch selection such as 'DNA:31' or 'protein:10'."
+    moltype, _, ksize = value.partition(':')
+    moltype = MOLTYPES.get(moltype.lower())
+    if moltype is None or not ksize.isdigit():
+        raise argparse.ArgumentTypeError(f"cannot parse '{value}'; should be moltype:ksize, e.g. 'DNA:31'")
+    return int(ksize), moltype
+
+
+def get_selection(ss):
+    "the (ksize, moltype) of a SourmashSignature or RawSignature."
+    if isinstance(ss, RawSignature):
+        return int(ss.row['ksize']), ss.row['moltype']
+    return ss.minhash.ksize, ss.minhash.moltype
+
+
+def format_selection(template, ksize, moltype):
+    "replace '{ksize}' and '{moltype}' in an output filename."
+    return template.replace('{ksize}', str(ksize)).replace('{moltype}', moltype)
+
+
+# the top-level 'name' key of a signature JSON record. Inside JSON strings
+# quotes are escaped, so this can only match a key.
+_name_key = re.compile(r'"name"\s*:\s*')
+_mins_key = re.compile(r'"mins"\s*:')
+
+
+def _single_signature_text(data):
+    """
+    Return serialized signature JSON 'data' (possibly gzipped) as text, or
+    None unless it holds exactly one named signature with one sketch.
+    """
+    if data[:2] == b'\x1f\x8b':
+        data = gzip.decompress(data)
+    text = data.decode('utf-8')
+
+    if len(_name_key.findall(text)) != 1 or len(_mins_key.findall(text)) != 1:
+        return None
+    return text
+
+
+def rename_raw_signature(data, name):
+    """
+    Change the name in serialized signature JSON 'data' (possibly gzipped)
+    without parsing the sketches. Returns the gzipped JSON, or None if
+    'data' does not hold exactly one named signature with one sketch.
+    """
+    text = _single_signature_text(data)
+    if text is None:
+        return None
+
+    # find the end of the old name value, and replace it.
+    start = _name_key.search(text).end()
+    try:
+        _, end = json.JSONDecoder().raw_decode(text, start)
+    except ValueError:
+        return None
+
+    text = text[:start] + json.dumps(name) + text[end:]
+    return gzip.compress(text.encode('utf-8'), compresslevel=1)
+
+
+class RawSignature:
+    """
+    A signature in a zip collection, as its manifest row and serialized
+    (gzipped JSON) data; it is only loaded on request. If 'new_name' is
+    set, the name is changed when the signature is serialized.
+    """
+    __slots__ = ('row', 'data', 'new_name')
+
+    def __init__(self, row, data, new_name=None):
+        self.row = row
+        self.data = data
+        self.new_name = new_name
+
+    @property
+    def name(self):
+        if self.new_name is not None:
+            return self.new_name
+        return self.row['name']
+
+    def load(self):
+        "load the signature."
+        # sourmash is much slower at reading gzipped JSON itself.
+        data = self.data
+        if data[:2] == b'\x1f\x8b':
+            data = gzip.decompress(data)
+
+        for ss in load_signatures_from_json(data):
+            if ss.md5sum() == self.row['md5']:
+                if self.new_name is not None:
+                    ss._name = self.new_name
+                return ss
+        raise ValueError(f"signature {self.row['md5']} not found at '{self.row['internal_location']}'")
+
+    def load_hashes(self):
+        """
+        Load the signature with an empty sketch, and return it along with
+        the lists of hashes and abundances (or None) from its sketch. This
+        is much faster than getting them from the loaded sketch.
+        """
+        data = self.data
+        if data[:2] == b'\x1f\x8b':
+            data = gzip.decompress(data)
+
+        for record in json.loads(data):
+            for sketch in record['signatures']:
+                if sketch['md5sum'] != self.row['md5']:
+                    continue
+
+                hashes, sketch['mins'] = sketch['mins'], []
+                abunds = sketch.get('abundances')
+                if abunds is not None:
+                    sketch['abundances'] = []
+                record['signatures'] = [sketch]
+                ss, = load_signatures_from_json(json.dumps([record]))
+                if self.new_name is not None:
+                    ss._name = self.new_name
+                return ss, hashes, abunds
+        raise ValueError(f"signature {self.row['md5']} not found at '{self.row['internal_location']}'")
+
+    def renamed(self, name):
+        "return this signature, to be renamed to 'name' when it is saved."
+        return RawSignature(self.row, self.data, new_name=name)
+
+    def copy(self):
+        """
+        Return (manifest row, gzipped JSON) by copying the data, patching
+        only the name; or None if the data holds more than this sketch.
+        """
+        row = dict(self.row)
+        data = self.data
+        if self.new_name is not None:
+            row['name'] = self.new_name
+            data = rename_raw_signature(data, self.new_name)
+        elif _single_signature_text(data) is None:
+            data = None
+        elif data[:2] != b'\x1f\x8b':
+            data = gzip.compress(data, compresslevel=1)
+
+        if data is None:
+            return None
+        return row, data
+
+
+class SignatureFile:
+    """
+    A signature saved to a file as gzipped JSON, as in zip collections,
+    along with its manifest row - e.g. to keep it out of memory until it
+    is saved. ZipSignatureWriter copies the file without loading it.
+    """
+    __slots__ = ('row', 'filename')
+
+    def __init__(self, row, filename):
+        self.row = row
+        self.filename = filename
+
+    @classmethod
+    def save(cls, filename, ss):
+        "save a SourmashSignature or RawSignature to 'filename'."
+        row, data, _ = serialize_signature(ss)
+        with open(filename, 'wb') as fp:
+            fp.write(data)
+        return cls(row, filename)
+
+    @property
+    def name(self):
+        return self.row['name']
+
+    def load(self):
+        "load the signature."
+        with gzip.open(self.filename, 'rb') as fp:
+            ss, = load_signatures_from_json(fp.read())
+        return ss
+
+
+def _write_values(fp, chunks, md5=None):
+    """
+    write the values in 'chunks' to 'fp', separated by commas, and update
+    'md5' with them, unseparated; return the number of values.
+    """
+    sep = ""
+    n = 0
+    for chunk in chunks:
+        if len(chunk):
+            text = ",".join(map(str, chunk))
+            fp.write(sep + text)
+            if md5 is not None:
+                md5.update(text.replace(",", "").encode('ascii'))
+            sep = ","
+            n += len(chunk)
+    return n
+
+
+def save_signature_file(filename, ss, iter_chunks):
+    """
+    Save signature 'ss' to 'filename' as a SignatureFile, with the hashes
+    and abundances of its sketch from 'iter_chunks()' rather than from
+    'ss', whose sketch is empty. 'iter_chunks()' yields lists of sorted
+    hashes along with their abundances (or None), and is called for each
+    pass over them, so that the full sketch is never held in memory.
+    """
+    text = save_signatures_to_json([ss]).decode('utf-8')
+    ksize = json.loads(text)[0]['signatures'][0]['ksize']
+
+    # fill in the JSON for the empty sketch. The md5sum follows the
+    # hashes, and is calculated from the ksize and hashes as sourmash does.
+    head, _, tail = text.partition('"mins":[]')
+    old_md5 = f'"md5sum":"{ss.md5sum()}"'
+    assert old_md5 in tail
+    md5 = hashlib.md5(str(ksize).encode('ascii'))
+    with gzip.open(filename, 'wt', encoding='utf-8', compresslevel=1) as fp:
+        fp.write(head + '"mins":[')
+        n_hashes = _write_values(fp, (hashes for (hashes, _) in iter_chunks()),
+                                 md5)
+        md5sum = md5.hexdigest()
+
+        tail = tail.replace(old_md5, f'"md5sum":"{md5sum}"', 1)
+        abund_head, abund_key, abund_tail = tail.partition('"abundances":[]')
+        if abund_key:
+            fp.write("]" + abund_head + '"abundances":[')
+            _write_values(fp, (abunds for (_, abunds) in iter_chunks()))
+            fp.write("]" + abund_tail)
+        else:
+            fp.write("]" + tail)
+
+    row = CollectionManifest.make_manifest_row(ss, None,
+                                               include_signature=False)
+    row['md5'] = md5sum
+    row['md5short'] = md5sum[:8]
+    row['n_hashes'] = n_hashes
+    return SignatureFile(row, filename)
+
+
+def serialize_signature(ss):
+    """
+    Return (manifest row, gzipped JSON, copied) for a SourmashSignature or
+    RawSignature, as saved in zip collections. RawSignatures are copied
+    if possible ('copied' is True), and loaded otherwise - e.g. for
+    members with several sketches.
+    """
+    if isinstance(ss, RawSignature):
+        copied = ss.copy()
+        if copied is not None:
+            return (*copied, True)
+        ss = ss.load()
+
+    data = save_signatures_to_json([ss], compression=1)
+    row = CollectionManifest.make_manifest_row(ss, None,
+                                               include_signature=False)
+    return row, data, False
+
+
+def is_raw_zip(idx):
+    "can signatures be copied raw from this index, with 'iter_raw_signatures'?"
+    return isinstance(idx, ZipFileLinearIndex) and idx.manifest is not None
+
+
+def iter_raw_signatures(idx):
+    """
+    Yield a RawSignature for each row in the manifest of the zip collection
+    'idx', in manifest order, reading each member only once. Members are
+    read with zipfile, because sourmash maps the zip file into memory,
+    where everything read from it stays.
+    """
+    location = data = None
+    with zipfile.ZipFile(idx.location) as zf:
+        for row in idx.manifest.rows:
+            if row['internal_location'] != location:
+                location = row['internal_location']
+                data = zf.read(location)
+            yield RawSignature(row, data)
+
+
+class ZipSignatureWriter:
+    """
+    Save signatures to a zip collection laid out as sourmash does - one
+    gzipped JSON member per signature, plus a manifest - accepting
+    RawSignature and SignatureFile objects as well as SourmashSignature
+    objects.
+
+    With jobs > 1, signatures are serialized and compressed in a thread
+    pool, and written to the zip file in the order they were added.
+
+    As with sourmash, signatures are added to an existing zip collection
+    rather than replacing it: its contents are copied into a new zip file,
+    which replaces it on close.
+    """
+    def __init__(self, location, *, jobs=1):
+        self.location = location
+        self.jobs = jobs
+        self.zf = None
+        self.executor = None
+        self.pending = deque()
+        self.manifest_rows = []
+        self.n_copied = 0
+        self._n_existing = 0
+        self._paths = set()
+        self._output = location
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __len__(self):
+        "the number of signatures added."
+        return len(self.manifest_rows) - self._n_existing + len(self.pending)
+
+    def open(self):
+        existing = None
+        if os.path.exists(self.location):
+            existing = zipfile.ZipFile(self.location)
+            try:
+                manifest_data = existing.read("SOURMASH-MANIFEST.csv")
+            except KeyError:
+                existing.close()
+                raise ValueError(f"Cannot add to existing zipfile '{self.location}' without a manifest")
+            self._output = self.location + '.tmp'
+
+        self.zf = zipfile.ZipFile(self._output, 'w', allowZip64=True)
+
+        if existing is not None:
+            with existing:
+                for info in existing.infolist():
+                    if info.filename != "SOURMASH-MANIFEST.csv":
+                        self.zf.writestr(info, existing.read(info))
+                        self._paths.add(info.filename)
+
+            manifest_fp = StringIO(manifest_data.decode('utf-8'))
+            manifest = CollectionManifest.load_from_csv(manifest_fp)
+            self.manifest_rows.extend(manifest.rows)
+            self._n_existing = len(self.manifest_rows)
+
+        if self.jobs > 1:
+            self.executor = ThreadPoolExecutor(max_workers=self.jobs)
+
+    def _write(self, row, data, copied):
+        md5 = row['md5']
+        path = f"signatures/{md5}.sig.gz"
+        n = 0
+        while path in self._paths:
+            path = f"signatures/{md5}.sig.gz_{n}"
+            n += 1
+        self._paths.add(path)
+
+        if isinstance(data, SignatureFile):
+            self.zf.write(data.filename, path,
+                          compress_type=zipfile.ZIP_STORED)
+        else:
+            self.zf.writestr(path, data, compress_type=zipfile.ZIP_STORED)
+        row['internal_location'] = path
+        self.manifest_rows.append(row)
+        self.n_copied += copied
+
+    def add(self, ss):
+        if isinstance(ss, SignatureFile):
+            # copy the file, after anything added before it.
+            while self.pending:
+                self._write(*self.pending.popleft().result())
+            self._write(dict(ss.row), ss, False)
+            return
+
+        if self.executor is None:
+            self._write(*serialize_signature(ss))
+            return
+
+        self.pending.append(self.executor.submit(serialize_signature, ss))
+
+        # write out finished signatures in order, and don't let too many
+        # pile up.
+        while self.pending and (self.pending[0].done() or
+                                len(self.pending) > self.jobs * 4):
+            self._write(*self.pending.popleft().result())
+
+    def close(self):
+        while self.pending:
+            self._write(*self.pending.popleft().result())
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+        manifest = CollectionManifest(self.manifest_rows)
+        manifest_fp = StringIO()
+        manifest.write_to_csv(manifest_fp, write_header=True)
+        self.zf.writestr("SOURMASH-MANIFEST.csv",
+                         manifest_fp.getvalue().encode('utf-8'),
+                         compress_type=zipfile.ZIP_DEFLATED)
+        self.zf.close()
+
+        if self._output != self.location:
+            os.replace(self._output, self.location)
+
+
+def open_signature_output(location, *, jobs=1):
+    """
+    Open 'location' for saving signatures: zip files with a
+    ZipSignatureWriter using 'jobs' threads, and anything else with sourmash.
+    """
+    if location.endswith('.zip'):
+        return ZipSignatureWriter(location, jobs=jobs)
+    return sourmash_args.SaveSignaturesToLocation(location)
+
+
+class _JSONReader:
+    """
+    A minimal incremental JSON reader for a binary file, holding about one
+    chunk (plus any token that spans chunks) in memory.
+    """
+    _ws = re.compile(rb'\s*')
+    _string = re.compile(rb'"(?:[^"\\]|\\.)*"', re.DOTALL)
+    _scalar = re.compile(rb'-?[0-9][0-9.eE+-]*|true|false|null')
+
+    def __init__(self, fp, *, chunk_size=2**16):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = b''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        "read another chunk; return False at the end of the file."
+        if not self.eof:
+            data = self.fp.read(self.chunk_size)
+            if data:
+                self.buf = self.buf[self.pos:] + data
+                self.pos = 0
+                return True
+            self.eof = True
+        return False
+
+    def peek(self):
+        "return the next non-whitespace character, or b'' at the end."
+        while True:
+            self.pos = self._ws.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos:self.pos + 1]
+            if not self._fill():
+                return b''
+
+    def expect(self, ch):
+        if self.peek() != ch:
+            raise ValueError(f"invalid JSON: expected {ch!r}")
+        self.pos += 1
+
+    def _match(self, pattern):
+        self.peek()
+        while True:
+            m = pattern.match(self.buf, self.pos)
+            # a token at the end of the buffer may continue in the next chunk.
+            if m and m.end() < len(self.buf):
+                break
+            if not self._fill():
+                break
+        if m is None:
+            raise ValueError("invalid JSON")
+        self.pos = m.end()
+        return m.group()
+
+    def read_value(self):
+        "read a (small) JSON value."
+        ch = self.peek()
+        if ch == b'{':
+            return { key: self.read_value() for key in self.iter_object() }
+        elif ch == b'[':
+            return [ self.read_value() for _ in self.iter_array() ]
+        elif ch == b'"':
+            return json.loads(self._match(self._string))
+        return json.loads(self._match(self._scalar))
+
+    def iter_object(self):
+        "yield the keys of an object; the caller must read each value."
+        self.expect(b'{')
+        if self.peek() == b'}':
+            self.pos += 1
+            return
+        while True:
+            key = json.loads(self._match(self._string))
+            self.expect(b':')
+            yield key
+            if self.peek() != b',':
+                self.expect(b'}')
+                return
+            self.pos += 1
+
+    def iter_array(self):
+        "yield for each element of an array; the caller must read each one."
+        self.expect(b'[')
+        if self.peek() == b']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.peek() != b',':
+                self.expect(b']')
+                return
+            self.pos += 1
+
+    def iter_array_slices(self):
+        """
+        Read an array of numbers, yielding its contents - numbers, commas
+        and whitespace - as bytes, a chunk at a time, never splitting a
+        number across slices.
+        """
+        self.expect(b'[')
+        while True:
+            end = self.buf.find(b']', self.pos)
+            if end >= 0:
+                yield self.buf[self.pos:end]
+                self.pos = end + 1
+                return
+
+            cut = max(self.buf.rfind(b',', self.pos), self.pos)
+            yield self.buf[self.pos:cut]
+            self.pos = cut
+            if not self._fill():
+                raise ValueError("invalid JSON: unterminated array")
+
+
+def _scan_sketch(reader):
+    fields = {}
+    md5 = None
+    pending = []
+    n_commas = 0
+    has_hashes = False
+    with_abundance = False
+
+    for key in reader.iter_object():
+        if key == 'mins':
+            # the md5sum covers the ksize and then each hash, in order,
+            # as decimal strings with no separators.
+            if 'ksize' in fields:
+                md5 = hashlib.md5(str(fields['ksize']).encode())
+            for data in reader.iter_array_slices():
+                n_commas += data.count(b',')
+                digits = data.translate(None, b', \t\r\n')
+                if digits:
+                    has_hashes = True
+                    if md5 is not None:
+                        md5.update(digits)
+                    else:
+                        pending.append(digits)
+        elif key == 'abundances':
+            with_abundance = True
+            for data in reader.iter_array_slices():
+                pass
+        else:
+            fields[key] = reader.read_value()
+
+    n_hashes = n_commas + 1 if has_hashes else 0
+    if md5 is None:
+        md5 = hashlib.md5(str(fields['ksize']).encode())
+        for digits in pending:
+            md5.update(digits)
+
+    moltype = MOLTYPES[fields.get('molecule', 'dna').lower()]
+    ksize = fields['ksize']
+    if moltype != 'DNA':
+        ksize //= 3
+
+    md5 = md5.hexdigest()
+    return dict(md5=md5, md5short=md5[:8], ksize=ksize, moltype=moltype,
+                num=fields.get('num', 0),
+                scaled=_get_scaled_for_max_hash(fields.get('max_hash', 0)),
+                n_hashes=n_hashes, with_abundance=with_abundance)
+
+
+def scan_signature_json(fp):
+    """
+    Yield a manifest row (without 'internal_location') for each sketch in
+    the signature JSON read from binary file 'fp'. The hashes are streamed,
+    to count them and compute the md5sum, and are never held in memory.
+    Raises ValueError if 'fp' does not hold sourmash signatures.
+    """
+    reader = _JSONReader(fp)
+    if reader.peek() != b'[':
+        raise ValueError("not a list of sourmash signatures")
+
+    for _ in reader.iter_array():
+        fields = {}
+        rows = []
+        for key in reader.iter_object():
+            if key == 'signatures':
+                for _ in reader.iter_array():
+                    rows.append(_scan_sketch(reader))
+            else:
+                fields[key] = reader.read_value()
+
+        if fields.get('class') != 'sourmash_signature':
+            raise ValueError("not a sourmash signature")
+
+        for row in rows:
+            row['name'] = fields.get('name') or ''
+            row['filename'] = fields.get('filename') or ''
+            yield row
+
+    if reader.peek() != b'':
+        raise ValueError("invalid JSON: trailing data")
+
+
+def scan_signature_file(filename):
+    """
+    Return the manifest rows for the sketches in a .sig or .sig.gz file,
+    with 'scan_signature_json'.
+    """
+    with open(filename, 'rb') as fp:
+        is_gzip = fp.read(2) == b'\x1f\x8b'
+
+    opener = gzip.open if is_gzip else open
+    with opener(filename, 'rb') as fp:
+        rows = list(scan_signature_json(fp))
+
+    for row in rows:
+        row['internal_location'] = filename
+    return rows
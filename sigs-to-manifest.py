@@ -1,9 +1,189 @@
 #! /usr/bin/env python
 import sys
+import os
+import csv
+import hashlib
+import functools
+import zipfile
 import sourmash
 from sourmash.logging import notify, error, set_quiet
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 from sourmash.manifest import CollectionManifest
+from sourmash.index.sqlite_index import SqliteCollectionManifest
+
+from masslib import scan_signature_file
+
+
+def fingerprints_filename(manifest_filename):
+    "the side table of file fingerprints for a manifest."
+    return manifest_filename + '.fingerprints.csv'
+
+
+def hash_file(loc, *, chunk_size=2**20):
+    "a fast hash of the contents of 'loc'."
+    h = hashlib.blake2b(digest_size=16)
+    with open(loc, 'rb') as fp:
+        while chunk := fp.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def file_fingerprint(loc, *, with_hash=False):
+    """
+    the size, mtime, and (optionally) content hash of 'loc'; directories
+    are not hashed.
+    """
+    st = os.stat(loc)
+    with_hash = with_hash and os.path.isfile(loc)
+    return dict(internal_location=loc, size=st.st_size,
+                mtime_ns=st.st_mtime_ns,
+                hash=hash_file(loc) if with_hash else '')
+
+
+def is_unchanged(loc, previous, *, with_hash=False):
+    """
+    Check whether 'loc' matches its previous fingerprint. Returns the
+    current fingerprint if so, and None if 'loc' has changed.
+    """
+    if previous is None:
+        return None
+
+    fingerprint = file_fingerprint(loc)
+    if fingerprint['size'] != previous['size']:
+        return None
+    if fingerprint['mtime_ns'] == previous['mtime_ns']:
+        return previous
+
+    # touched, but perhaps not changed?
+    if with_hash and previous['hash']:
+        fingerprint['hash'] = hash_file(loc)
+        if fingerprint['hash'] == previous['hash']:
+            return fingerprint
+
+    return None
+
+
+def load_fingerprints(filename):
+    "load a fingerprints side table into a dict { location: fingerprint }."
+    fingerprints = {}
+    with open(filename, newline='') as fp:
+        for row in csv.DictReader(fp):
+            row['size'] = int(row['size'])
+            row['mtime_ns'] = int(row['mtime_ns'])
+            fingerprints[row['internal_location']] = row
+    return fingerprints
+
+
+def write_fingerprints(filename, fingerprints):
+    with open(filename, 'w', newline='') as fp:
+        w = csv.DictWriter(fp, fieldnames=['internal_location', 'size',
+                                           'mtime_ns', 'hash'])
+        w.writeheader()
+        w.writerows(fingerprints)
+
+
+def is_sqlite_file(loc):
+    with open(loc, 'rb') as fp:
+        return fp.read(16) == b'SQLite format 3\x00'
+
+
+def collection_manifest_rows(loc):
+    """
+    Return the rows of the manifest carried by the zip or SQLite collection
+    'loc', with 'internal_location' set to 'loc'; or None if 'loc' is not
+    such a collection.
+    """
+    if not os.path.isfile(loc):
+        return None
+    if not (zipfile.is_zipfile(loc) or is_sqlite_file(loc)):
+        return None
+
+    idx = sourmash.load_file_as_index(loc)
+    if idx.manifest is None:
+        return None
+
+    rows = []
+    for row in idx.manifest.rows:
+        row = { k: row[k] for k in CollectionManifest.required_keys }
+        row['internal_location'] = loc
+        rows.append(row)
+    return rows
+
+
+def load_manifest_rows(loc, *, with_hash=False):
+    """
+    load the signatures in 'loc' and return the file fingerprint and
+    their manifest rows. Zip and SQLite collections with manifests are
+    not loaded; their manifest rows are used instead. Signature JSON
+    files are scanned without building MinHash objects.
+    """
+    fingerprint = file_fingerprint(loc, with_hash=with_hash)
+    rows = collection_manifest_rows(loc)
+    if rows is None and os.path.isfile(loc):
+        try:
+            rows = scan_signature_file(loc)
+        except (ValueError, KeyError, EOFError):
+            rows = None
+
+    # anything else, e.g. directories, load with sourmash.
+    if rows is None:
+        rows = [ CollectionManifest.make_manifest_row(ss, loc,
+                                                      include_signature=False)
+                 for ss in sourmash.load_file_as_signatures(loc) ]
+    return fingerprint, rows
+
+
+class SqlManifestWriter:
+    """
+    Insert manifest rows into a SQL manifest as they are produced,
+    committing once at least 'batch_size' rows are pending, so that memory
+    use stays constant and an interrupted run keeps (and can resume from)
+    its progress. Commits only happen between calls to 'add_rows', so each
+    file's rows are saved all together or not at all. The manifest is
+    only created when it is first needed.
+    """
+    def __init__(self, filename, *, append=False, batch_size=10000):
+        self.filename = filename
+        self.append = append
+        self.batch_size = batch_size
+        self.manifest = None
+        self._n_uncommitted = 0
+
+    def open(self):
+        if self.manifest is None:
+            if self.append:
+                self.manifest = SqliteCollectionManifest.create_or_open(self.filename)
+            else:
+                self.manifest = SqliteCollectionManifest.create(self.filename)
+        return self.manifest
+
+    def add_rows(self, rows):
+        "add the rows for one file."
+        manifest = self.open()
+        for row in rows:
+            manifest.add_row(row)
+            self._n_uncommitted += 1
+
+        if self._n_uncommitted >= self.batch_size:
+            manifest.conn.commit()
+            self._n_uncommitted = 0
+
+    def remove_locations(self, locations):
+        "remove all rows for these locations."
+        manifest = self.open()
+        manifest.conn.executemany("""DELETE FROM sourmash_sketches
+                                     WHERE internal_location=?""",
+                                  ( (loc,) for loc in locations ))
+        manifest.conn.commit()
+
+    def __len__(self):
+        return len(self.open())
+
+    def close(self):
+        if self.manifest is not None:
+            self.manifest.conn.commit()
+            self.manifest.close()
 
 
 def main():
@@ -17,20 +197,35 @@ def main():
     p.add_argument('--previous', help='previous manifest file')
     p.add_argument('--merge-previous', action='store_true',
                    help='merge previous and new manifests')
+    p.add_argument('--update', action='store_true',
+                   help="with --previous, re-read only new and changed files (by size and mtime, as recorded in '<manifest>.fingerprints.csv'), keep the rows for unchanged files, and drop rows for files that are no longer listed or no longer exist")
+    p.add_argument('--hash', action='store_true',
+                   help='also record a hash of each file, so that files with a new mtime but the same contents are not re-read by --update')
     p.add_argument('-d', '--debug', action='store_true',
                    help='output sourmash debug messages')
+    p.add_argument('-j', '--jobs', type=int, default=1,
+                   help='number of processes to use for loading signature files (default 1)')
     args = p.parse_args()
 
     set_quiet(False, args.debug)
 
+    if args.update and not args.previous:
+        error("ERROR: --update requires --previous.")
+        sys.exit(-1)
+
+    if args.update and args.merge_previous:
+        error("ERROR: --update and --merge-previous cannot be used together.")
+        sys.exit(-1)
+
     if args.previous and args.previous == args.output:
-        if not args.merge_previous:
+        if not (args.merge_previous or args.update):
             error("ERROR: --output and --previous are the same, but --merge-previous not specified.")
             error("ERROR: so --previous would be overwritten with only new entries!?")
             error("ERROR: I'm worried this doesn't make sense, so I'm exiting. Good bye!")
             sys.exit(-1)
 
     previous_filenames = set()
+    previous_fingerprints = {}
     previous = CollectionManifest([])
     if args.previous:
         notify(f"loading previous manifest from '{args.previous}'")
@@ -42,48 +237,162 @@ def main():
 
         notify(f"loaded {len(previous)} rows with {len(previous_filenames)} distinct sig files from '{args.previous}'")
 
+        fp_filename = fingerprints_filename(args.previous)
+        if os.path.exists(fp_filename):
+            previous_fingerprints = load_fingerprints(fp_filename)
+            notify(f"loaded {len(previous_fingerprints)} file fingerprints from '{fp_filename}'")
+        elif args.update:
+            notify(f"no file fingerprints found in '{fp_filename}'; re-reading all files.")
+
     rows = []
+    fingerprints = []
     n_files = 0
     n_skipped = 0
+    changed_locations = set()
+    n_missing = 0
+    kept_locations = set()
+
+    # with -j, load files in worker processes, handing them out in chunks;
+    # rows come back in input order.
+    executor = None
+    if args.jobs > 1:
+        executor = ProcessPoolExecutor(max_workers=args.jobs)
+    load_fn = functools.partial(load_manifest_rows, with_hash=args.hash)
+
+    # SQL manifests are written as rows are loaded; when --previous is the
+    # output, new rows are added to it directly.
+    sql_output = None
+    in_place = args.previous == args.output
+    if args.database_format == 'sql':
+        if os.path.exists(args.output) and not in_place:
+            if args.update:
+                os.unlink(args.output)
+            elif not args.merge_previous:
+                error(f"ERROR: output manifest '{args.output}' already exists.")
+                sys.exit(-1)
+        sql_output = SqlManifestWriter(args.output,
+                                       append=in_place or args.merge_previous)
+    n_rows = 0
 
     for filename in set(args.pathlist):
         notify(f"Loading filenames from {filename}.")
         n_loaded = 0
+        locs = []
+        list_changed = set()
         with open(filename, 'rt') as fp:
             for loc in fp:
-                if n_files and n_files % 100 == 0:
-                    notify(f'... loaded {n_files} files, skipped {n_skipped}; {n_loaded} sigs', end='\r')
                 loc = loc.strip()
 
-                if loc in previous_filenames:
-                    n_skipped += 1
+                if args.update and not os.path.exists(loc):
+                    n_missing += 1
                     continue
 
-                for ss in sourmash.load_file_as_signatures(loc):
-                    row = CollectionManifest.make_manifest_row(ss,
-                                                               loc,
-                                                               include_signature=False)
-                    rows.append(row)
-                    n_loaded += 1
+                if loc in previous_filenames:
+                    if not args.update:
+                        n_skipped += 1
+                        continue
+
+                    fingerprint = is_unchanged(loc,
+                                               previous_fingerprints.get(loc),
+                                               with_hash=args.hash)
+                    if fingerprint is not None:
+                        if loc not in kept_locations:
+                            kept_locations.add(loc)
+                            fingerprints.append(fingerprint)
+                        n_skipped += 1
+                        continue
+                    changed_locations.add(loc)
+                    list_changed.add(loc)
+
+                locs.append(loc)
+
+        # changed files are replaced in place; only remove the rows for
+        # this list's files, as those of earlier lists are already new.
+        if sql_output is not None and in_place and list_changed:
+            sql_output.remove_locations(list_changed)
 
-                n_files += 1
+        if executor is None:
+            loaded = map(load_fn, locs)
+        else:
+            chunksize = max(1, min(100, len(locs) // (args.jobs * 4)))
+            loaded = executor.map(load_fn, locs, chunksize=chunksize)
+
+        for fingerprint, loc_rows in loaded:
+            if n_files and n_files % 100 == 0:
+                notify(f'... loaded {n_files} files, skipped {n_skipped}; {n_loaded} sigs', end='\r')
+            if sql_output is not None:
+                sql_output.add_rows(loc_rows)
+            else:
+                rows.extend(loc_rows)
+            n_rows += len(loc_rows)
+            fingerprints.append(fingerprint)
+            n_loaded += len(loc_rows)
+            n_files += 1
 
         notify(f"Loaded {n_loaded} manifest rows from files in '{filename}'")
 
-    if not rows:
+    if executor is not None:
+        executor.shutdown()
+
+    n_removed = 0
+    if args.update:
+        n_removed = len(previous_filenames - kept_locations -
+                        changed_locations)
+        notify(f"{len(changed_locations)} changed files re-read; {n_removed} files removed ({n_missing} listed but missing); {len(kept_locations)} files unchanged")
+
+    # with --update into a new output, the kept rows are always written,
+    # and in place, the old rows of changed files must be removed.
+    if (not n_rows and not n_removed and not changed_locations and
+            (in_place or not args.update)):
         notify(f"NO NEW MANIFEST ROWS DETECTED. Exiting!")
+        if sql_output is not None:
+            sql_output.close()
+        if args.update:
+            # unchanged files may have been touched; record their new mtimes.
+            write_fingerprints(fingerprints_filename(args.output), fingerprints)
         return 0
 
     if args.merge_previous:
-        # note, this is important for CSV manifests, but not for SQL manifests.
-        notify(f"merging previous rows into current.")
-        rows.extend(previous.rows)
+        fingerprints.extend(previous_fingerprints.values())
+
+    if sql_output is not None:
+        if in_place:
+            if args.update:
+                sql_output.remove_locations(previous_filenames -
+                                            kept_locations - changed_locations)
+        elif args.merge_previous:
+            notify(f"merging previous rows into current.")
+            sql_output.add_rows(previous.rows)
+        elif args.update:
+            sql_output.add_rows( row for row in previous.rows
+                                 if row['internal_location'] in kept_locations )
+
+        num_saved = len(sql_output)
+        sql_output.close()
+    else:
+        if args.merge_previous:
+            # note, this is important for CSV manifests, but not for SQL manifests.
+            notify(f"merging previous rows into current.")
+            rows.extend(previous.rows)
+        elif args.update:
+            rows.extend( row for row in previous.rows
+                         if row['internal_location'] in kept_locations )
+
+        m = CollectionManifest(rows)
+        if args.update:
+            # write a complete new manifest, replacing any old one.
+            tmp_output = args.output + '.tmp'
+            m.write_to_filename(tmp_output, database_format='csv',
+                                ok_if_exists=True)
+            os.replace(tmp_output, args.output)
+        else:
+            m.write_to_filename(args.output, database_format='csv',
+                                ok_if_exists=args.merge_previous)
+        num_saved = len(m)
 
-    m = CollectionManifest(rows)
-    m.write_to_filename(args.output, database_format=args.database_format,
-                        ok_if_exists=args.merge_previous)
+    notify(f"saved {num_saved} manifest rows to '{args.output}'")
 
-    notify(f"saved {len(m)} manifest rows to '{args.output}'")
+    write_fingerprints(fingerprints_filename(args.output), fingerprints)
 
     return 0
 
@@ -0,0 +1,95 @@
+#! /usr/bin/env python3
+"""
+Compare the memory used to track fromfile records as a dict of plain
+(__dict__-based) objects, as genbank-to-fromfile.py used to, with
+kiln.InputFileStore.
+
+Filenames and names are allocated up front, as they are in the real
+scripts (args.filenames, the assembly summary), so only the cost of the
+record-keeping itself is measured.
+"""
+import sys
+import os
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from kiln import InputFile, InputFileStore
+
+
+class DictInputFile(object):
+    "the old InputFile: class attribute defaults, per-instance __dict__."
+    ident = None
+    full_ident = None
+    genome_filename = None
+    protein_filename = None
+    name = None
+
+
+def make_inputs(n):
+    inputs = []
+    for i in range(n):
+        full_ident = f"GCF_{i:09d}.1"
+        name = f"{full_ident} Some organism strain {i}"
+        for suffix in ('_genomic.fna.gz', '_protein.faa.gz'):
+            inputs.append((f"genomes/{full_ident}_ASM{i}v1{suffix}", name))
+    return inputs
+
+
+def build(inputs, fileinfo_d, fileinfo_cls):
+    for filename, name in inputs:
+        full_ident = "_".join(os.path.basename(filename).split('_')[:2])
+        ident = full_ident.split('.', 1)[0]
+
+        fileinfo = fileinfo_cls()
+        fileinfo.ident = ident
+        fileinfo.full_ident = full_ident
+        fileinfo.name = name
+        if filename.endswith('.faa.gz'):
+            fileinfo.protein_filename = filename
+        else:
+            fileinfo.genome_filename = filename
+
+        previous = fileinfo_d.get(ident)
+        if previous is not None:
+            if previous.genome_filename:
+                fileinfo.genome_filename = previous.genome_filename
+            else:
+                fileinfo.protein_filename = previous.protein_filename
+        fileinfo_d[ident] = fileinfo
+
+    return fileinfo_d
+
+
+def measure(inputs, fileinfo_d, fileinfo_cls):
+    tracemalloc.start()
+    fileinfo_d = build(inputs, fileinfo_d, fileinfo_cls)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(fileinfo_d) == len(inputs) // 2
+    return current, peak
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('-n', '--num-records', type=int, default=200_000)
+    args = p.parse_args()
+
+    inputs = make_inputs(args.num_records)
+
+    results = [('dict of __dict__ objects',
+                measure(inputs, {}, DictInputFile)),
+               ('InputFileStore',
+                measure(inputs, InputFileStore(), InputFile))]
+
+    print(f"{args.num_records} records:")
+    for label, (current, peak) in results:
+        print(f"  {label:<26} {current / 2**20:8.1f} MiB retained, "
+              f"{peak / 2**20:8.1f} MiB peak, "
+              f"{current / args.num_records:6.0f} bytes/record")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,44 @@
+#! /usr/bin/env python3
+"""
+Check that two manifests, in any format sourmash can load, list the same
+sketches (by md5sum) for the same files, e.g. after
+'sigs-to-manifest.py --update' and when built from scratch.
+"""
+import sys
+import argparse
+
+from sourmash.manifest import CollectionManifest
+
+
+def load_sketches(filename):
+    manifest = CollectionManifest.load_from_filename(filename)
+    return sorted( (row['internal_location'], row['md5'])
+                   for row in manifest.rows )
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('manifest1')
+    p.add_argument('manifest2')
+    args = p.parse_args()
+
+    sketches1 = load_sketches(args.manifest1)
+    sketches2 = load_sketches(args.manifest2)
+
+    only1 = set(sketches1) - set(sketches2)
+    only2 = set(sketches2) - set(sketches1)
+    for loc, md5 in sorted(only1):
+        print(f"only in '{args.manifest1}': {loc} {md5}")
+    for loc, md5 in sorted(only2):
+        print(f"only in '{args.manifest2}': {loc} {md5}")
+
+    if only1 or only2 or len(sketches1) != len(sketches2):
+        print(f"manifests differ: {len(sketches1)} vs {len(sketches2)} rows")
+        return 1
+
+    print(f"manifests match: {len(sketches1)} rows")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
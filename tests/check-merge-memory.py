@@ -0,0 +1,118 @@
+#! /usr/bin/env python3
+"""
+Check that 'mass-merge.py --max-memory' stays near its memory limit.
+
+Makes a zip collection of random signatures in a few merge groups, and
+runs mass-merge.py on it with --check (the baseline, for loading the
+manifests), without a limit, and with --max-memory. The peak RSS of the
+last must be within the baseline plus the limit plus some slack, and
+its output must match the unlimited run.
+"""
+import sys
+import os
+import argparse
+import csv
+import subprocess
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import sourmash
+from sourmash import sourmash_args
+
+MASS_MERGE = os.path.join(os.path.dirname(__file__), '..', 'mass-merge.py')
+
+
+def make_database(dirname, *, num_groups, sigs_per_group, num_hashes):
+    "write a zip collection and spreadsheet; return their filenames."
+    rng = np.random.default_rng(1)
+    db = os.path.join(dirname, 'db.zip')
+    spreadsheet = os.path.join(dirname, 'spreadsheet.csv')
+
+    with sourmash_args.SaveSignaturesToLocation(db) as save_sigs, \
+         open(spreadsheet, 'w', newline='') as fp:
+        w = csv.writer(fp)
+        w.writerow(['ident', 'species'])
+
+        # interleave the groups, so that they are all merged at once.
+        for i in range(num_groups * sigs_per_group):
+            ident = f"GCF_{i:09d}.1"
+            w.writerow([ident, f"species {i % num_groups}"])
+
+            mh = sourmash.MinHash(0, 31, scaled=1000, track_abundance=True)
+            hashes = rng.integers(1, mh._max_hash, num_hashes,
+                                  dtype=np.uint64)
+            abunds = rng.integers(1, 10, num_hashes, dtype=np.uint64)
+            mh.set_abundances(dict(zip(hashes.tolist(), abunds.tolist())))
+            save_sigs.add(sourmash.SourmashSignature(mh, name=f"{ident} test genome {i}"))
+
+    return db, spreadsheet
+
+
+def run_mass_merge(*args):
+    "run mass-merge.py; return its peak RSS in bytes."
+    p = subprocess.Popen([sys.executable, MASS_MERGE, *args, '-q'])
+    _, status, rusage = os.wait4(p.pid, 0)
+    if os.waitstatus_to_exitcode(status):
+        sys.exit(f"mass-merge.py {' '.join(args)} failed")
+
+    # ru_maxrss is in KiB on Linux, and starts from the RSS of this
+    # process when the child is forked.
+    return rusage.ru_maxrss * 1024
+
+
+def load_sketches(filename):
+    manifest = sourmash.load_file_as_index(filename).manifest
+    return sorted( (row['name'], row['md5']) for row in manifest.rows )
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--max-memory-mb', type=int, default=20)
+    p.add_argument('--slack-mb', type=int, default=64,
+                   help='memory allowed over the limit, e.g. for loading one signature')
+    p.add_argument('--num-groups', type=int, default=4)
+    p.add_argument('--sigs-per-group', type=int, default=8)
+    p.add_argument('--num-hashes', type=int, default=250_000)
+    args = p.parse_args()
+
+    with tempfile.TemporaryDirectory() as dirname:
+        # make the database in a separate process, to keep this one small.
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(1, mp_context=context) as executor:
+            db, spreadsheet = executor.submit(make_database, dirname,
+                                    num_groups=args.num_groups,
+                                    sigs_per_group=args.sigs_per_group,
+                                    num_hashes=args.num_hashes).result()
+        merge_args = [db, '-F', spreadsheet, '--merge-col', 'species']
+        full = os.path.join(dirname, 'full.zip')
+        limited = os.path.join(dirname, 'limited.zip')
+
+        check_rss = run_mass_merge(*merge_args, '--check')
+        full_rss = run_mass_merge(*merge_args, '-o', full)
+        limited_rss = run_mass_merge(*merge_args, '-o', limited,
+                                     '--max-memory', f"{args.max_memory_mb}M",
+                                     '--tmpdir', dirname)
+        same_output = load_sketches(full) == load_sketches(limited)
+
+    allowed = check_rss + (args.max_memory_mb + args.slack_mb) * 2**20
+    print(f"peak RSS with --check:      {check_rss / 2**20:8.1f} MiB")
+    print(f"peak RSS without a limit:   {full_rss / 2**20:8.1f} MiB")
+    print(f"peak RSS with --max-memory: {limited_rss / 2**20:8.1f} MiB (allowed {allowed / 2**20:.1f} MiB)")
+
+    status = 0
+    if full_rss <= allowed:
+        print("merging without a limit fits in the allowed memory; use more or bigger signatures")
+        status = 1
+    if limited_rss > allowed:
+        print("merging with --max-memory used too much memory")
+        status = 1
+    if not same_output:
+        print("merged signatures differ with --max-memory")
+        status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
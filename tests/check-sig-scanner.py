@@ -0,0 +1,47 @@
+#! /usr/bin/env python3
+"""
+Check that masslib.scan_signature_file, which sigs-to-manifest.py uses for
+.sig and .sig.gz files, gives the same manifest rows as loading the
+signatures with sourmash and calling CollectionManifest.make_manifest_row.
+"""
+import sys
+import os
+import argparse
+
+import sourmash
+from sourmash.manifest import CollectionManifest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from masslib import scan_signature_file
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('sigfiles', nargs='+')
+    args = p.parse_args()
+
+    n_rows = 0
+    n_mismatched = 0
+    for filename in args.sigfiles:
+        expected = [ CollectionManifest.make_manifest_row(ss, filename,
+                                                          include_signature=False)
+                     for ss in sourmash.load_file_as_signatures(filename) ]
+        scanned = scan_signature_file(filename)
+
+        if len(scanned) != len(expected):
+            print(f"{filename}: scanned {len(scanned)} rows, expected {len(expected)}")
+            n_mismatched += 1
+            continue
+
+        for row, expected_row in zip(scanned, expected):
+            n_rows += 1
+            if row != expected_row:
+                print(f"{filename}: mismatch\n  scanned:  {row}\n  expected: {expected_row}")
+                n_mismatched += 1
+
+    print(f"checked {n_rows} rows from {len(args.sigfiles)} files; {n_mismatched} mismatches")
+    return 1 if n_mismatched else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,51 @@
+#! /usr/bin/env python3
+"""
+Check that two collections of signatures, in any format sourmash can
+load, hold the same sketches (by md5sum, and abundances) with the same
+names, in any order - e.g. from mass-merge.py run in different modes.
+"""
+import sys
+import argparse
+import hashlib
+
+import sourmash
+
+
+def load_sketches(filename):
+    sketches = []
+    for ss in sourmash.load_file_as_signatures(filename):
+        mh = ss.minhash
+        abunds = ""
+        if mh.track_abundance:
+            abunds = hashlib.md5(str(list(mh.hashes.values())).encode('ascii')).hexdigest()
+        sketches.append((ss.name, ss.md5sum(), mh.ksize, mh.moltype,
+                         mh.scaled, abunds))
+    return sorted(sketches)
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('sigs1')
+    p.add_argument('sigs2')
+    args = p.parse_args()
+
+    sketches1 = load_sketches(args.sigs1)
+    sketches2 = load_sketches(args.sigs2)
+
+    only1 = set(sketches1) - set(sketches2)
+    only2 = set(sketches2) - set(sketches1)
+    for sketch in sorted(only1):
+        print(f"only in '{args.sigs1}': {sketch}")
+    for sketch in sorted(only2):
+        print(f"only in '{args.sigs2}': {sketch}")
+
+    if only1 or only2 or len(sketches1) != len(sketches2):
+        print(f"signatures differ: {len(sketches1)} vs {len(sketches2)}")
+        return 1
+
+    print(f"signatures match: {len(sketches1)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+#! /usr/bin/env python3
+"""
+Make random signatures for testing mass-merge.py and mass-rename.py: two
+zip collections with the identifiers split between them, and a
+spreadsheet with 'ident', 'name', 'species', 'genus', and 'family'
+columns. Species have one to four identifiers, genera two species each,
+and there is a single family.
+
+Each identifier has DNA k=21 and k=31 sketches and a protein k=10 sketch,
+all with abundances; sketches in the same genus share some hashes.
+"""
+import sys
+import argparse
+import csv
+
+import numpy as np
+import sourmash
+from sourmash import sourmash_args
+
+SKETCHES = [(21, 'DNA'), (31, 'DNA'), (10, 'protein')]
+SPECIES_SIZES = [1, 3, 2, 1, 4]
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('db1')
+    p.add_argument('db2')
+    p.add_argument('-S', '--spreadsheet', required=True)
+    p.add_argument('-n', '--num-idents', type=int, default=24)
+    p.add_argument('--num-hashes', type=int, default=2000)
+    args = p.parse_args()
+
+    rng = np.random.default_rng(1)
+    max_hash = sourmash.MinHash(0, 31, scaled=10)._max_hash
+
+    # assign identifiers to species, cycling through the species sizes.
+    species = []
+    while len(species) < args.num_idents:
+        size = SPECIES_SIZES[len(set(species)) % len(SPECIES_SIZES)]
+        species.extend([len(set(species))] * size)
+    species = species[:args.num_idents]
+
+    pools = {}
+    with sourmash_args.SaveSignaturesToLocation(args.db1) as save1, \
+         sourmash_args.SaveSignaturesToLocation(args.db2) as save2, \
+         open(args.spreadsheet, 'w', newline='') as fp:
+        w = csv.writer(fp)
+        w.writerow(['ident', 'name', 'species', 'genus', 'family'])
+
+        for i, sp in enumerate(species):
+            ident = f"GCF_{i:09d}.1"
+            genus = sp // 2
+            w.writerow([ident, f"{ident} renamed genome {i}",
+                        f"Testus species {sp}", f"Testus{genus}",
+                        "Testaceae"])
+
+            save_sigs = save1 if i % 2 == 0 else save2
+            for ksize, moltype in SKETCHES:
+                key = (genus, ksize, moltype)
+                if key not in pools:
+                    pools[key] = rng.integers(1, max_hash,
+                                              args.num_hashes * 2,
+                                              dtype=np.uint64)
+                shared = rng.choice(pools[key], args.num_hashes // 2,
+                                    replace=False)
+                own = rng.integers(1, max_hash, args.num_hashes // 2,
+                                   dtype=np.uint64)
+                hashes = np.concatenate([shared, own]).tolist()
+                abunds = rng.integers(1, 10, len(hashes)).tolist()
+
+                mh = sourmash.MinHash(0, ksize, scaled=10,
+                                      is_protein=(moltype == 'protein'),
+                                      track_abundance=True)
+                mh.set_abundances(dict(zip(hashes, abunds)))
+                name = f"{ident} Testus species {sp} genome {i}"
+                save_sigs.add(sourmash.SourmashSignature(mh, name=name))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())